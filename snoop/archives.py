@@ -6,6 +6,8 @@ from django.conf import settings
 import shutil
 from . import models
 from . import exceptions
+from . import failures
+from .utils import backend_slot
 from .walker import Walker
 
 KNOWN_TYPES = {
@@ -41,16 +43,25 @@ def _other_temps(sha1, current):
             return True
     return False
 
+@failures.version_detector('7z')
+def sevenzip_version():
+    output = subprocess.run(
+        [settings.SNOOP_SEVENZIP_BINARY],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=10,
+    ).stdout
+    return output.decode().strip().splitlines()[0]
+
 def call_7z(archive_path, output_dir):
     try:
-        subprocess.check_output([
-            settings.SNOOP_SEVENZIP_BINARY,
-            '-y',
-            '-pp',
-            'x',
-            str(archive_path),
-            '-o' + str(output_dir),
-        ], stderr=subprocess.STDOUT)
+        with backend_slot('7z'):
+            subprocess.check_output([
+                settings.SNOOP_SEVENZIP_BINARY,
+                '-y',
+                '-pp',
+                'x',
+                str(archive_path),
+                '-o' + str(output_dir),
+            ], stderr=subprocess.STDOUT)
 
     except subprocess.CalledProcessError as e:
         sevenzip_output = e.output.decode()
@@ -66,6 +77,7 @@ def extract_to_base(doc):
     base = CACHE_ROOT / doc.sha1
     if base.is_dir():
         return
+    failures.check('7z', doc.sha1)
 
     tmp = Path(tempfile.mkdtemp(
         prefix=doc.sha1,
@@ -81,8 +93,9 @@ def extract_to_base(doc):
         try:
             call_7z(archive.path, tmp)
 
-        except Exception:
+        except Exception as e:
             tmp.rename(tmp.with_name('broken_' + tmp.name))
+            failures.record('7z', doc.sha1, e)
             raise
 
         else:
@@ -0,0 +1,398 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from functools import wraps
+from pathlib import Path
+from time import time
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from .compression import plain_fields
+
+MISS = object()
+
+class MemoryTier(object):
+    """ The most recently used values, decoded, in this process, up to
+    ``size`` bytes, as measured by their JSON. Values over an eighth of that
+    are not kept, so that one of them can't push out all the others. Callers
+    must not modify the values they get from the cache. """
+
+    name = 'memory'
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self.values = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                return MISS
+            self.values.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value):
+        size = len(json.dumps(value))
+        with self.lock:
+            old = self.values.pop(key, None)
+            if old is not None:
+                self.used -= old[1]
+            if size > self.size // 8:
+                return
+            self.values[key] = (value, size)
+            self.used += size
+            while self.used > self.size:
+                _, (_, evicted) = self.values.popitem(last=False)
+                self.used -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.used = 0
+
+def _is_stale(age):
+    # don't record every access; once in a while is enough to tell hot
+    # entries from cold ones
+    return age > settings.SNOOP_CACHE_TOUCH_INTERVAL
+
+class DiskTier(object):
+    """ JSON files in a local folder, ``<root>/<cache>/<ab>/<hash>.json``.
+    A file's mtime is the last time it was used. """
+
+    name = 'disk'
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, key):
+        name = hashlib.sha1(key.encode('utf8')).hexdigest()
+        return self.root / name[:2] / (name + '.json')
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with path.open('rb') as f:
+                data = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+            if _is_stale(time() - mtime):
+                os.utime(str(path))
+        except FileNotFoundError:
+            return MISS
+        return json.loads(data.decode('utf8'))
+
+    def set(self, key, value):
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write to a temporary file, then move it in place, so readers
+        # never see a half-written value
+        with tempfile.NamedTemporaryFile(dir=str(path.parent),
+                                         delete=False) as tmp:
+            tmp.write(json.dumps(value).encode('utf8'))
+        os.rename(tmp.name, str(path))
+
+    def files(self):
+        if not self.root.is_dir():
+            return
+        for dirpath, _, filenames in os.walk(str(self.root)):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield (stat.st_mtime, stat.st_size, path)
+
+    def usage(self):
+        files = list(self.files())
+        return {'entries': len(files), 'bytes': sum(f[1] for f in files)}
+
+    def gc(self, max_age=None, max_size=None, dry_run=False):
+        """ Delete files not used for ``max_age`` days, then the least
+        recently used ones, until the rest fit in ``max_size`` bytes.
+        Returns the number of deleted files and their size. """
+        doomed = []
+        total = 0
+        oldest = time() - max_age * 86400 if max_age is not None else None
+        for mtime, size, path in sorted(self.files(), reverse=True):
+            total += size
+            if (oldest is not None and mtime < oldest) or \
+                    (max_size is not None and total > max_size):
+                doomed.append((size, path))
+
+        if not dry_run:
+            for _, path in doomed:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return (len(doomed), sum(size for size, _ in doomed))
+
+def _loads(values):
+    """ Decode the first of ``values`` that is set. """
+    return json.loads(next(value for value in values if value is not None))
+
+class DatabaseTier(object):
+    """ A table with a primary key, a ``value`` column holding JSON, and a
+    ``time``, which is the last time the entry was used. Tables that are
+    only collected by ``cachegc`` may name another column, or no column,
+    in which case whole rows are counted. """
+
+    name = 'db'
+
+    def __init__(self, model, value='value'):
+        self.model = model
+        self.value = value
+        table = model._meta.db_table
+        pk = model._meta.pk.column
+        self.sql_params = {'table': table, 'pk': pk}
+        if value is None:
+            self.sql_params['size'] = 'pg_column_size({}.*)'.format(table)
+            return
+
+        self.field = model._meta.get_field(value)
+        column = self.field.column
+        self.sql_params['value'] = column
+        self.sql_params['size'] = 'pg_column_size({})'.format(column)
+        # entries from before the value was compressed, if there's a column
+        # for them; `compressdata` moves them to the compressed one
+        self.values = [value]
+        for field, plain in plain_fields(model):
+            if field is self.field:
+                self.values.append(plain.name)
+                self.sql_params['size'] = (
+                    'coalesce(pg_column_size({}), pg_column_size({}))'
+                    .format(column, plain.column)
+                )
+        # one statement, in autocommit; no transaction is held open
+        self.upsert_sql = (
+            "INSERT INTO {table} ({pk}, {value}, time) "
+            "VALUES (%s, %s, now()) "
+            "ON CONFLICT ({pk}) DO UPDATE "
+            "SET {value} = EXCLUDED.{value}, time = EXCLUDED.time"
+        ).format(**self.sql_params)
+
+    def touch(self, key, used):
+        """ Record that the entry for ``key``, last used at ``used``, was
+        used again. """
+        now = timezone.now()
+        if _is_stale((now - used).total_seconds()):
+            self.model.objects.filter(pk=key).update(time=now)
+
+    def get(self, key):
+        row = (
+            self.model.objects
+            .filter(pk=key)
+            .values_list(*self.values, 'time')
+            .first()
+        )
+        if row is None:
+            return MISS
+        *values, used = row
+        self.touch(key, used)
+        return _loads(values)
+
+    def get_many(self, keys):
+        """ Look up ``keys`` in one query. Returns the entries found. """
+        rows = (
+            self.model.objects
+            .filter(pk__in=keys)
+            .values_list('pk', *self.values, 'time')
+        )
+        found = {}
+        stale = []
+        now = timezone.now()
+        for key, *values, used in rows:
+            found[key] = _loads(values)
+            if _is_stale((now - used).total_seconds()):
+                stale.append(key)
+        if stale:
+            self.model.objects.filter(pk__in=stale).update(time=now)
+        return found
+
+    def set(self, key, value):
+        with connection.cursor() as cursor:
+            data = self.field.get_db_prep_value(json.dumps(value), connection)
+            cursor.execute(self.upsert_sql, [key, data])
+
+    def _query(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(**self.sql_params), params)
+            if cursor.description:
+                return cursor.fetchone()
+            return cursor.rowcount
+
+    def usage(self):
+        entries, data = self._query(
+            "SELECT count(*), coalesce(sum({size}), 0) FROM {table}"
+        )
+        [table] = self._query("SELECT pg_total_relation_size('{table}')")
+        return {'entries': entries, 'bytes': data, 'table_bytes': table}
+
+    def gc(self, max_age=None, max_size=None, dry_run=False):
+        """ Delete entries not used for ``max_age`` days, then the least
+        recently used ones, until the rest fit in ``max_size`` bytes. Returns the number of deleted entries and their size. """
+        conditions = []
+        params = []
+        if max_age is not None:
+            conditions.append("time < %s")
+            params.append(timezone.now() - timedelta(days=max_age))
+        if max_size is not None:
+            conditions.append("running_size > %s")
+            params.append(max_size)
+        if not conditions:
+            return (0, 0)
+
+        doomed = (
+            "SELECT {pk} FROM ("
+            "  SELECT {pk}, time, sum({size}) OVER ("
+            "    ORDER BY time DESC, {pk}"
+            "  ) AS running_size FROM {table}"
+            ") AS entries WHERE " + " OR ".join(conditions)
+        )
+        count, size = self._query(
+            "SELECT count(*), coalesce(sum({size}), 0) "
+            "FROM {table} WHERE {pk} IN (" + doomed + ")",
+            params,
+        )
+        if count and not dry_run:
+            self._query(
+                "DELETE FROM {table} WHERE {pk} IN (" + doomed + ")",
+                params,
+            )
+        return (count, size)
+
+class Cache(object):
+    """ A cache for the results of expensive calls (Tika, email parsing,
+    text extraction), keyed by a hash of the content they came from.
+
+    There are up to three tiers, looked up in order: an LRU dictionary in
+    the worker process, files on local disk (if ``SNOOP_CACHE_DISK_ROOT``
+    is set), and a database table. A hit in a lower tier is copied to the
+    tiers above it. Nothing is locked while a value is computed, so two
+    workers may compute the same value at once, and the last write wins.
+    """
+
+    def __init__(self, name, model):
+        self.name = name
+        self.model = model
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+        self._tiers = None
+
+    @property
+    def tiers(self):
+        if self._tiers is None:
+            tiers = [MemoryTier(settings.SNOOP_CACHE_MEMORY_SIZE)]
+            if settings.SNOOP_CACHE_DISK_ROOT:
+                root = Path(settings.SNOOP_CACHE_DISK_ROOT) / self.name
+                tiers.append(DiskTier(root))
+            tiers.append(DatabaseTier(self.model))
+            self._tiers = tiers
+        return self._tiers
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'miss': 0}
+
+    def count(self, event):
+        with self.stats_lock:
+            self.stats[event] = self.stats.get(event, 0) + 1
+
+    def get(self, key):
+        for n, tier in enumerate(self.tiers):
+            value = tier.get(key)
+            if value is not MISS:
+                self.count(tier.name + '_hit')
+                for upper in self.tiers[:n]:
+                    upper.set(key, value)
+                return value
+        self.count('miss')
+        return MISS
+
+    def set(self, key, value):
+        for tier in reversed(self.tiers):
+            tier.set(key, value)
+
+    def prefetch(self, keys):
+        """ Copy the database entries for ``keys`` to memory, in one query,
+        so the lookups that follow don't go to the database one by one. """
+        if not settings.SNOOP_CACHE:
+            return
+        memory = self.tiers[0]
+        keys = {key for key in keys if key is not None}
+        missing = [key for key in keys if memory.get(key) is MISS]
+        if not missing:
+            return
+        for key, value in self.tiers[-1].get_many(missing).items():
+            memory.set(key, value)
+
+    def budget(self):
+        return budget(self.name)
+
+caches = {}
+
+# other tables of content-keyed rows that `cachegc` collects, by name
+tables = {}
+
+def budget(name):
+    """ The ``SNOOP_CACHE_GC`` settings for the cache or table ``name``. """
+    return dict(
+        settings.SNOOP_CACHE_GC['default'],
+        **settings.SNOOP_CACHE_GC.get(name, {})
+    )
+
+def cached(name, model, keyfunc):
+    """ Cache the results of the decorated function in the cache called
+    ``name``, stored in ``model``. ``keyfunc`` is called with the function's
+    arguments and returns the key. Keys should be hashes of the content the
+    value depends on, so duplicates share cache entries. If ``keyfunc``
+    returns ``None``, before or after the call, the call is not cached. """
+
+    cache = caches[name] = Cache(name, model)
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not settings.SNOOP_CACHE:
+                return func(*args, **kwargs)
+
+            key = keyfunc(*args, **kwargs)
+            if key is None:
+                return func(*args, **kwargs)
+
+            value = cache.get(key)
+            if value is MISS:
+                value = func(*args, **kwargs)
+                # the call may have found out its result isn't worth keeping
+                if keyfunc(*args, **kwargs) is not None:
+                    cache.set(key, value)
+            return value
+
+        wrapper.no_cache = func
+        wrapper.cache = cache
+        wrapper.key = keyfunc
+        return wrapper
+
+    return decorator
+
+def content_key(doc, *extra):
+    """ A cache key for a value computed from ``doc``'s content, or
+    ``None`` if the document was not hashed yet. """
+    if not doc.sha1:
+        return None
+    return ':'.join([doc.sha1] + [str(bit) for bit in extra])
+
+def stats():
+    """ Hit and miss counters of each cache, since the process started. """
+    return {
+        name: dict(cache.stats)
+        for name, cache in caches.items()
+        if any(cache.stats.values())
+    }
@@ -0,0 +1,129 @@
+import zlib
+from django.db import models
+from django.db.models.signals import class_prepared, post_init
+from django.dispatch import receiver
+
+# short values are stored as they are; compressing them saves little, and
+# Postgres already has to read the whole row anyway
+COMPRESS_MIN_SIZE = 256
+
+COMPRESS_LEVEL = 6
+
+# A preset dictionary primes the compressor with strings that are in most
+# of our values: digest, email and Tika metadata keys. It's what makes small
+# values compress well. The dictionary can never change once values were
+# encoded with it; to use a better one, add it under a new version.
+DICTIONARIES = {
+    1: (
+        '"X-Parsed-By": ["org.apache.tika.parser.DefaultParser", '
+        '"org.apache.tika.parser.'
+        '"Content-Type": "text/plain; charset=UTF-8", '
+        '"Content-Encoding": "UTF-8", "Content-Length": '
+        '"Last-Modified": "Creation-Date": "Last-Save-Date": '
+        '"dcterms:created": "dcterms:modified": "meta:author": "dc:title": '
+        '"dc:creator": "xmpTPg:NPages": "pdf:PDFVersion": "resourceName": '
+        '"Content-Transfer-Encoding": "quoted-printable", "base64", '
+        '"Content-Disposition": "attachment; filename=", '
+        '"MIME-Version": ["1.0"], "Message-ID": ["<", "In-Reply-To": '
+        '"References": "Received": ["from ", "by ", "with ", "Date": ['
+        '"From": [", "To": [", "Cc": [", "Subject": [", '
+        '"X-Mailer": "Thread-Index": "X-MS-Has-Attach": '
+        '{"headers": {"parts": [{"content_type": "multipart/mixed", '
+        '"multipart/alternative", "text/html", "application/pdf", '
+        '"attachments": {"filename": "path": "rev": "content-type": '
+        '"type": "email", "folder", "text", "date": "date-created": '
+        '"md5": "sha1": "size": "lang": "en", "word-count": "broken": '
+        '"from": "to": ["subject": "pgp": false, "ocr": {}, "text": "'
+    ).encode('utf8'),
+}
+
+CURRENT_VERSION = 1
+
+# plain UTF-8 text never starts with a NUL byte, so this marks compressed
+# values, and anything else is stored as it is
+MARKER = b'\0'
+
+def encode(text, version=CURRENT_VERSION):
+    """ Encode ``text`` for storage: compressed, if that makes it smaller,
+    otherwise plain UTF-8. """
+    data = text.encode('utf8')
+    if len(data) < COMPRESS_MIN_SIZE:
+        return data
+
+    compressor = zlib.compressobj(COMPRESS_LEVEL,
+                                  zdict=DICTIONARIES[version])
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) + 2 >= len(data):
+        return data
+    return MARKER + bytes([version]) + compressed
+
+def is_compressed(data):
+    return data[:1] == MARKER
+
+def decode(data):
+    """ Decode a value written by ``encode``, or plain UTF-8. """
+    data = bytes(data)
+    if not is_compressed(data):
+        return data.decode('utf8')
+
+    version = data[1]
+    decompressor = zlib.decompressobj(zdict=DICTIONARIES[version])
+    return (decompressor.decompress(data[2:]) +
+            decompressor.flush()).decode('utf8')
+
+class CompressedTextField(models.BinaryField):
+    """ A text field, stored compressed in a ``bytea`` column. Models see
+    plain strings. Rows from before the column was compressed keep their
+    text in the ``<name>_plain`` column next to it, until ``compressdata``
+    moves it; see ``CompressedModel``. """
+
+    def from_db_value(self, value, expression, connection, context):
+        if value is None:
+            return value
+        return decode(value)
+
+    def to_python(self, value):
+        if isinstance(value, (bytes, memoryview)):
+            return decode(value)
+        return value
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = encode(value)
+        return super().get_db_prep_value(value, connection, prepared)
+
+def plain_name(name):
+    """ The column that holds the uncompressed values of field ``name``. """
+    return name + '_plain'
+
+def plain_fields(model):
+    """ Pairs of ``(field, plain field)`` of ``model``. """
+    names = {field.name: field for field in model._meta.fields}
+    for field in model._meta.fields:
+        if isinstance(field, CompressedTextField):
+            plain = names.get(plain_name(field.name))
+            if plain is not None:
+                yield field, plain
+
+class CompressedModel(models.Model):
+    """ A model with ``CompressedTextField``s that had rows before they were
+    compressed. Those rows are read from the plain columns, and saving them
+    again moves their text to the compressed column. """
+
+    class Meta:
+        abstract = True
+
+def _read_plain(sender, instance, **kwargs):
+    for field, plain in plain_fields(sender):
+        # deferred fields are not in the instance dict
+        text = instance.__dict__.get(plain.attname)
+        if text is not None:
+            if instance.__dict__.get(field.attname) is None:
+                setattr(instance, field.attname, text)
+            setattr(instance, plain.attname, None)
+
+@receiver(class_prepared)
+def _connect_read_plain(sender, **kwargs):
+    # only for these models; `post_init` runs for every row that is loaded
+    if issubclass(sender, CompressedModel) and any(plain_fields(sender)):
+        post_init.connect(_read_plain, sender=sender)
@@ -75,7 +75,12 @@ MAGIC_DESCRIPTION_TYPES = {
 MAGIC_READ_LIMIT = 24 * 1024 * 1024
 
 def libmagic_guess_content_type(file, filesize):
-    buffer = file.read(min(MAGIC_READ_LIMIT, filesize))
+    return libmagic_guess_buffer(file.read(min(MAGIC_READ_LIMIT, filesize)))
+
+def libmagic_guess_buffer(buffer):
+    """ Guess the content type from the first ``MAGIC_READ_LIMIT`` bytes of
+    a file. """
+    buffer = bytes(buffer)
     content_type = magic.from_buffer(buffer, mime=True)
     if content_type in FILE_TYPES:
         return content_type
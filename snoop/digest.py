@@ -1,8 +1,12 @@
 from datetime import datetime
 from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.utils.timezone import utc
 import hashlib
 import json
+import tempfile
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 from .tikalib import tika_parse, extract_meta, tika_lang
 from . import emails
@@ -14,13 +18,109 @@ from . import pst
 from . import exceptions
 from . import pgp
 from . import html
-from .content_types import guess_filetype, libmagic_guess_content_type
-from .utils import chunks, word_count, worker_metrics, extract_exif
+from . import hashing
+from . import cache
+from .content_types import guess_filetype, libmagic_guess_buffer
+from .utils import word_count, worker_metrics, extract_exif
 
 INHERITABLE_DOCUMENT_FLAGS = [
     'pgp',
 ]
 
+# digest keys that are worked out for each document; the rest of the digest
+# only depends on the content, and is shared with duplicates
+DOCUMENT_KEYS = [
+    'path',
+    'filename',
+    'rev',
+    'message',
+    'pgp',
+    'ocr',
+]
+
+# bump this when a change to the code changes the content part of digests,
+# so that the content stored by the older code is not reused
+CONTENT_VERSION = 1
+
+# the stored content and container members are collected by `cachegc`
+cache.tables['content'] = cache.DatabaseTier(models.ContentDigest, 'data')
+cache.tables['members'] = cache.DatabaseTier(models.ContainerMember, None)
+
+def content_version():
+    """ Content is only reused by digests that would come up with the same
+    data: the same code, and the same settings for the backends. """
+    used = [
+        CONTENT_VERSION,
+        bool(settings.SNOOP_TIKA_SERVER_ENDPOINT),
+        sorted(settings.SNOOP_TIKA_FILE_TYPES),
+        settings.SNOOP_TIKA_MAX_FILE_SIZE,
+        settings.SNOOP_ANALYZE_LANG,
+        bool(settings.SNOOP_MSGCONVERT_SCRIPT),
+        bool(settings.SNOOP_SEVENZIP_BINARY),
+        bool(settings.SNOOP_READPST_BINARY),
+        bool(pgp.is_enabled()),
+    ]
+    return hashlib.sha1(json.dumps(used).encode('utf8')).hexdigest()
+
+# rows that the digests of the current batch of jobs will look up, loaded
+# all at once by `prefetch`; each worker thread has its own batch
+_prefetched = threading.local()
+
+@contextmanager
+def prefetch(jobs):
+    """ Load the rows that the digests of a batch of ``jobs`` will look up,
+    with one query per table: stored content, OCR text, and the cache
+    entries for content that wasn't digested before. Documents that were
+    never hashed have nothing to look up yet. The rows are used until the
+    context exits. """
+    docs = list(
+        models.Document.objects
+        .filter(id__in=[job['id'] for job in jobs])
+        .exclude(sha1='')
+        .select_related('collection')
+    )
+
+    contents = {doc.sha1: {} for doc in docs}
+    stored = models.ContentDigest.objects.filter(
+        sha1__in=list(contents),
+        version=content_version(),
+    )
+    for row in stored:
+        contents[row.sha1][row.content_type] = row
+
+    ocr = {(doc.collection_id, doc.md5): [] for doc in docs}
+    ocr_items = models.Ocr.objects.filter(
+        collection_id__in={doc.collection_id for doc in docs},
+        md5__in={doc.md5 for doc in docs},
+    )
+    for item in ocr_items:
+        ocr.get((item.collection_id, item.md5), []).append(item)
+
+    _prefetched.contents = contents
+    _prefetched.ocr = ocr
+
+    # the language cache is keyed by the text, which we don't know yet
+    new = [doc for doc in docs if doc.content_type not in contents[doc.sha1]]
+    filetypes = {doc.id: guess_filetype(doc) for doc in new}
+    tika_parse.cache.prefetch(
+        doc.sha1 for doc in new
+        if filetypes[doc.id] in settings.SNOOP_TIKA_FILE_TYPES
+    )
+    text.get_text.cache.prefetch(
+        text.get_text.key(doc) for doc in new
+        if filetypes[doc.id] in ['text', 'html']
+    )
+    emails.raw_parse_email.cache.prefetch(
+        emails.raw_parse_email.key(doc) for doc in new
+        if emails.is_email(doc)
+    )
+
+    try:
+        yield
+    finally:
+        del _prefetched.contents
+        del _prefetched.ocr
+
 def _path_bits(doc):
     if doc.container:
         yield from _path_bits(doc.container)
@@ -31,50 +131,244 @@ def _path_bits(doc):
     else:
         yield doc.path
 
-def _calculate_hashes(opened_file):
+def _read_once(doc, spool=None, want_head=False):
+    """ Read the document in a single pass. Returns its md5, sha1, size
+    and, with ``want_head``, the first ``MAGIC_READ_LIMIT`` bytes for
+    libmagic. If ``spool`` is given, a copy of the document is written to
+    it along the way. """
+    with doc.open() as f:
+        return hashing.hash_file(f, spool, want_head=want_head)
+
+def _moved_digest(doc):
+    """ Find the digest of a deleted document in the same collection with
+    the same content; it's probably ``doc`` before it was moved. """
+    moved = (
+        models.Document.objects
+        .filter(
+            collection_id=doc.collection_id,
+            deleted=True,
+            sha1=doc.sha1,
+            disk_size=doc.disk_size,
+            content_type=doc.content_type,
+        )
+        .exclude(id=doc.id)
+        .values_list('id', flat=True)
+    )
+    digest = (
+        models.Digest.objects
+        .filter(id__in=moved, version=content_version())
+        .first()
+    )
+    if digest:
+        return json.loads(digest.data)
+
+def _shares_content(doc):
+    # an unsaved document is not part of a collection yet, and emlx parsing
+    # looks at the files next to the message
+    return doc.pk is not None and doc.content_type != 'message/x-emlx'
+
+def _stored_content(doc):
+    """ Find the content part of a digest for ``doc``: from another
+    document with the same content, in any collection, or from ``doc``
+    before it was moved. """
+    if not settings.SNOOP_CACHE or not _shares_content(doc):
+        return None
+
+    contents = getattr(_prefetched, 'contents', {})
+    if doc.sha1 in contents:
+        stored = contents[doc.sha1].get(doc.content_type)
+    else:
+        stored = models.ContentDigest.objects.filter(
+            sha1=doc.sha1,
+            content_type=doc.content_type,
+            version=content_version(),
+        ).first()
+    if stored is not None:
+        cache.tables['content'].touch(stored.pk, stored.time)
+        return json.loads(stored.data)
+
+    moved = _moved_digest(doc)
+    if moved is not None:
+        # like stored content, keep `pgp`, which flags the document
+        for key in DOCUMENT_KEYS:
+            if key != 'pgp':
+                moved.pop(key, None)
+        return moved
+
+def _store_content(doc, content):
+    if not settings.SNOOP_CACHE or not _shares_content(doc):
+        return
+    if doc.flags.get('msgconvert_fail'):
+        return  # the content is what we got from an empty email
+    try:
+        with transaction.atomic():
+            stored, _ = models.ContentDigest.objects.update_or_create(
+                sha1=doc.sha1,
+                content_type=doc.content_type,
+                version=content_version(),
+                defaults={'data': json.dumps(content)},
+            )
+    except IntegrityError:
+        return  # another worker got there first
+
+    # for documents later in the batch with the same content
+    contents = getattr(_prefetched, 'contents', {})
+    if doc.sha1 in contents:
+        contents[doc.sha1][doc.content_type] = stored
+
+def _member_hashes(doc):
+    """ If ``doc``'s container was seen before, maybe in another
+    collection, take ``doc``'s hashes from there instead of reading it.
+    Returns ``True`` if it worked. """
+    if not doc.container_id or not doc.container.sha1:
+        return False
+    member = models.ContainerMember.objects.filter(
+        container_sha1=doc.container.sha1,
+        path=doc.path,
+    ).first()
+    if member is None:
+        return False
+
+    cache.tables['members'].touch(member.pk, member.time)
+    doc.sha1 = member.sha1
+    doc.md5 = member.md5
+    if not doc.disk_size:
+        doc.disk_size = member.size
+    if not doc.content_type:
+        doc.content_type = member.content_type
+    return True
+
+def _remember_member(doc):
+    if not doc.container_id or not doc.container.sha1 or doc.pk is None:
+        return
+    try:
+        with transaction.atomic():
+            models.ContainerMember.objects.create(
+                container_sha1=doc.container.sha1,
+                path=doc.path,
+                sha1=doc.sha1,
+                md5=doc.md5,
+                size=doc.disk_size,
+                content_type=doc.content_type,
+            )
+    except IntegrityError:
+        pass
+
+def _new_spool(doc):
+    # archive and pst members are opened from the files extracted under the
+    # cache root, so only email parts are worth a copy
+    if doc.container_id and emails.is_email(doc.container):
+        return tempfile.SpooledTemporaryFile(
+            max_size=settings.SNOOP_DIGEST_SPOOL_MEMORY,
+        )
 
-    md5 = hashlib.md5()
-    sha1 = hashlib.sha1()
+def digest(doc, refresh=False):
+    """ Digest the document, reading its content as little as possible.
+
+    The hashes and content type come from a first pass over the content,
+    or, for a document in an email or archive that we've seen before, from
+    ``ContainerMember``. The rest of the digest only depends on the
+    content, so if a document with the same content was already digested,
+    in any collection, we reuse its data; only the keys in
+    ``DOCUMENT_KEYS`` are worked out for each document. With ``refresh``,
+    the content is worked out again, and replaces the stored one.
+
+    Opening an email attachment means parsing the email again, so for those
+    we keep a copy in a spooled temporary file, and the later stages read
+    from there. Other documents, on disk or extracted from an archive, are
+    opened again, and served from the page cache.
+    """
+    spool = _new_spool(doc)
+    spooled = False
+
+    try:
+        if not doc.sha1 and _member_hashes(doc):
+            doc.save()
+
+        if not doc.sha1:
+            md5, sha1, fsize, head = _read_once(
+                doc, spool, want_head=not doc.content_type)
+            spooled = True
+            if not doc.content_type:
+                doc.content_type = libmagic_guess_buffer(head)
+            if not doc.disk_size:
+                doc.disk_size = fsize
+            doc.sha1 = sha1
+            doc.md5 = md5
+            doc.save()
+            _remember_member(doc)
+
+        content = None
+        if refresh:
+            # give msgconvert another chance
+            doc.flags.pop('msgconvert_fail', None)
+        else:
+            content = _stored_content(doc)
+
+        if content is None:
+            if spool is not None:
+                if not spooled:
+                    _read_once(doc, spool)
+                doc.spool = spool
+            content = _digest_content(doc)
+            _store_content(doc, content)
+
+        elif content.get('pgp') and 'pgp' not in doc.flags:
+            # the flag comes from the content, like when parsing the email
+            doc.flags['pgp'] = content['pgp']
+            doc.save()
+
+        return _digest_document(doc, content)
+
+    finally:
+        if spool is not None:
+            doc.spool = None
+            spool.close()
+
+def _digest_document(doc, content):
+    data = dict(content)
+    data.pop('pgp', None)
+    data.update({
+        'path': '//'.join(_path_bits(doc)),
+        'filename': doc.filename,
+        'rev': doc.rev,
+    })
 
-    for data in chunks(opened_file):
-        md5.update(data)
-        sha1.update(data)
+    if 'pgp' in doc.flags:
+        data['pgp'] = doc.flags['pgp']
 
-    fsize = opened_file.tell()
+    if doc.container_id:
+        data['message'] = doc.container_id
 
-    return (md5.hexdigest(), sha1.hexdigest(), fsize)
+    ocr_items = _ocr_items(doc)
+    if ocr_items:
+        data['ocr'] = {ocr.tag: ocr.text for ocr in ocr_items}
 
-def digest(doc):
-    if not doc.sha1:
-        with doc.open() as f:
-            md5, sha1, fsize = _calculate_hashes(f)
-            if not doc.content_type:
-                f.seek(0)
-                doc.content_type = libmagic_guess_content_type(f, fsize)
-        if not doc.disk_size:
-            doc.disk_size = fsize
-        doc.sha1 = sha1
-        doc.md5 = md5
-        doc.save()
+    return data
 
+def _ocr_items(doc):
+    ocr = getattr(_prefetched, 'ocr', {})
+    key = (doc.collection_id, doc.md5)
+    if key in ocr:
+        return ocr[key]
+    return list(models.Ocr.objects.filter(
+        collection_id=doc.collection_id,
+        md5=doc.md5
+    ))
+
+def _digest_content(doc):
     data = {
-        'path': '//'.join(_path_bits(doc)),
         'lang': None,
         'sha1': doc.sha1,
         'md5': doc.md5,
-        'filename': doc.filename,
-        'rev': doc.rev,
     }
 
+    had_pgp = 'pgp' in doc.flags
     if emails.is_email(doc):
         data.update(emails.parse_email(doc))
-
-    if 'pgp' in doc.flags:
+    if 'pgp' in doc.flags and not had_pgp:
         data['pgp'] = doc.flags['pgp']
 
-    if doc.container_id:
-        data['message'] = doc.container_id
-
     filetype = guess_filetype(doc)
     data['type'] = filetype
 
@@ -101,13 +395,6 @@ def digest(doc):
     if 'text' in data:
         data['word-count'] = word_count(data['text'])
 
-    ocr_items = list(models.Ocr.objects.filter(
-        collection_id=doc.collection.id,
-        md5=doc.md5
-    ))
-    if ocr_items:
-        data['ocr'] = {ocr.tag: ocr.text for ocr in ocr_items}
-
     if archives.is_archive(doc):
         archives.extract_to_base(doc)
     if pst.is_pst_file(doc):
@@ -127,6 +414,7 @@ def create_email_children(doc, data, flags):
                 'disk_size': info.get('size', 0),
                 'content_type': info['content_type'],
                 'filename': info['filename'],
+                'deleted': False,
             },
         )
         children.append((child.id, created))
@@ -147,30 +435,38 @@ def create_children(doc, data, verbose=True):
     elif pst.is_pst_file(doc):
         children = pst.list_children(doc)
 
-    new_children = 0
+    new_children = []
     for doc_id, created in children:
         child = models.Document.objects.get(id=doc_id)
         child.flags.update(inherited_flags)
         child.save()
         if created:
-            queues.put('digest', {'id': doc_id}, verbose=verbose)
             if verbose: print('new child', doc_id)
-            new_children += 1
+            new_children.append(child)
 
-    return new_children
+    queues.put_documents(new_children, verbose=verbose)
+    return len(new_children)
 
 
-def worker(id, verbose):
+def worker(id, verbose, refresh=False):
     with worker_metrics(type='worker', queue='digest') as metrics:
         metrics['document'] = id
         try:
-            document = models.Document.objects.get(id=id)
+            document = (
+                models.Document.objects
+                .select_related('collection')
+                .get(id=id)
+            )
         except models.Document.DoesNotExist:
             if verbose: print('MISSING')
             metrics.update({'outcome': 'error', 'error': 'document_missing'})
             return
+        if document.deleted:
+            if verbose: print('DELETED')
+            metrics.update({'outcome': 'error', 'error': 'document_deleted'})
+            return
         try:
-            data = digest(document)
+            data = digest(document, refresh)
 
         except exceptions.BrokenDocument as e:
             assert e.flag is not None
@@ -192,7 +488,10 @@ def worker(id, verbose):
 
         models.Digest.objects.update_or_create(
             id=document.id,
-            defaults={'data': json.dumps(data)},
+            defaults={
+                'data': json.dumps(data),
+                'version': content_version(),
+            },
         )
         document.digested_at = datetime.utcnow().replace(tzinfo=utc)
         document.save()
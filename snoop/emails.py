@@ -1,4 +1,5 @@
 import re
+import hashlib
 import subprocess
 import codecs
 import tempfile
@@ -10,7 +11,9 @@ from pathlib import Path
 from django.conf import settings
 from . import models
 from . import exceptions
-from .utils import chunks
+from . import failures
+from .cache import cached, content_key
+from .utils import chunks, backend_slot
 from .html import text_from_html
 from .content_types import guess_content_type
 from . import pgp
@@ -274,10 +277,12 @@ def open_msg(doc):
         msg.symlink_to(path)
 
         try:
-            subprocess.check_output(
-                [settings.SNOOP_MSGCONVERT_SCRIPT, msg.name],
-                cwd=tmp,
-            )
+            with failures.remembered('msgconvert', doc.sha1), \
+                    backend_slot('msgconvert'):
+                subprocess.check_output(
+                    [settings.SNOOP_MSGCONVERT_SCRIPT, msg.name],
+                    cwd=tmp,
+                )
         except:
             if settings.SNOOP_FLAG_MSGCONVERT_FAIL:
                 doc.flags['msgconvert_fail'] = True
@@ -324,17 +329,33 @@ def open_email(doc):
 def get_email_part(doc, part):
     return open_email(doc).open_part(part)
 
-@models.cache(models.EmailCache, lambda doc: doc.id)
+def _email_cache_key(doc):
+    if doc.flags.get('msgconvert_fail'):
+        return None  # we parsed an empty email instead
+    if doc.content_type == 'message/x-emlx':
+        # the parser looks for attachments in files next to the message
+        path = str(doc.absolute_path).encode('utf8', 'surrogateescape')
+        return content_key(doc, 'emlx', hashlib.sha1(path).hexdigest())
+    return content_key(doc, doc.content_type)
+
+@cached('email', models.EmailCache, _email_cache_key)
 def raw_parse_email(doc):
     email = open_email(doc)
-    return {
+    parsed = {
         'tree': email.get_tree(),
         'attachments': email.get_attachments(),
         'text': email.get_text(),
     }
+    # parsing may find more encrypted parts, so ask last
+    parsed['pgp'] = email.pgp
+    return parsed
 
 def parse_email(doc):
     parsed = raw_parse_email(doc)
+    # on a cache hit, ``open_email`` didn't run to flag the document
+    if parsed.get('pgp') and 'pgp' not in doc.flags:
+        doc.flags['pgp'] = True
+        doc.save()
     data = extract_email_data(parsed['tree'])
     data.update({
         'text': parsed['text'],
@@ -0,0 +1,90 @@
+import subprocess
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import IntegrityError
+from . import exceptions
+from . import models
+
+# errors that will happen again if we call the backend with the same content;
+# connection errors and the like are not remembered
+REMEMBERED = (
+    exceptions.BrokenDocument,
+    subprocess.CalledProcessError,
+    subprocess.TimeoutExpired,
+)
+
+_detectors = {}
+_versions = {}
+
+class KnownFailure(exceptions.BrokenDocument):
+    """ The backend failed on this content before, with the same version. """
+
+    def __init__(self, failure):
+        super().__init__("%s failed on %s before: %s %s" % (
+            failure.backend, failure.sha1, failure.error, failure.message))
+        self.flag = failure.flag or failure.backend + '_failed'
+
+def version_detector(backend):
+    """ Register a function that returns the version of ``backend``. """
+    def decorator(func):
+        _detectors[backend] = func
+        return func
+    return decorator
+
+def backend_version(backend):
+    """ The version of ``backend``, from ``SNOOP_BACKEND_VERSIONS``, or
+    asked from the backend once per process. Empty if we can't tell. """
+    if backend in settings.SNOOP_BACKEND_VERSIONS:
+        return settings.SNOOP_BACKEND_VERSIONS[backend]
+    if backend not in _versions:
+        try:
+            version = _detectors[backend]()
+        except Exception:
+            version = ''
+        _versions[backend] = (version or '')[:100]
+    return _versions[backend]
+
+def check(backend, sha1):
+    """ Raise ``KnownFailure`` if ``backend`` already failed on the content
+    with hash ``sha1``. Failures of other backend versions don't count. """
+    if not settings.SNOOP_REMEMBER_FAILURES or not sha1:
+        return
+    failure = (
+        models.ExtractionFailure.objects
+        .filter(backend=backend, sha1=sha1)
+        .first()
+    )
+    if failure and failure.version == backend_version(backend):
+        raise KnownFailure(failure)
+
+def record(backend, sha1, error, errors=REMEMBERED):
+    """ Remember that ``backend`` failed on the content with hash ``sha1``,
+    if ``error`` is one of ``errors``. """
+    if not settings.SNOOP_REMEMBER_FAILURES or not sha1:
+        return
+    if isinstance(error, KnownFailure) or not isinstance(error, errors):
+        return
+    try:
+        models.ExtractionFailure.objects.update_or_create(
+            backend=backend,
+            sha1=sha1,
+            defaults={
+                'error': type(error).__name__,
+                'message': str(error)[:1000],
+                'flag': getattr(error, 'flag', None) or '',
+                'version': backend_version(backend),
+            },
+        )
+    except IntegrityError:
+        pass  # another worker recorded it at the same time
+
+@contextmanager
+def remembered(backend, sha1, errors=REMEMBERED):
+    """ Skip content that ``backend`` failed on before, and remember the
+    content it fails on now, if the error is one of ``errors``. """
+    check(backend, sha1)
+    try:
+        yield
+    except Exception as e:
+        record(backend, sha1, e, errors)
+        raise
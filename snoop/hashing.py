@@ -0,0 +1,88 @@
+import hashlib
+import io
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from .content_types import MAGIC_READ_LIMIT
+
+MB = 1024 * 1024
+
+# hashlib releases the GIL while it hashes a large buffer, so with big
+# blocks md5 and sha1 really run in parallel
+BLOCK_SIZE = 16 * MB
+
+# below this size, starting a thread costs more than it saves
+PARALLEL_MIN_SIZE = 4 * MB
+
+def _update(hashes, blocks, executor=None):
+    md5, sha1 = hashes
+    for block in blocks:
+        if executor is None or len(block) < PARALLEL_MIN_SIZE:
+            md5.update(block)
+            sha1.update(block)
+        else:
+            future = executor.submit(md5.update, block)
+            sha1.update(block)
+            future.result()
+
+def _mmap_blocks(view, size):
+    for offset in range(0, size, BLOCK_SIZE):
+        yield view[offset:offset + BLOCK_SIZE]
+
+def _read_blocks(file, spool, head):
+    while True:
+        block = file.read(BLOCK_SIZE)
+        if not block:
+            return
+        if head is not None and len(head) < MAGIC_READ_LIMIT:
+            head += block[:MAGIC_READ_LIMIT - len(head)]
+        if spool is not None:
+            spool.write(block)
+        yield block
+
+def _fileno(file):
+    try:
+        return file.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return None
+
+def hash_file(file, spool=None, parallel=True, want_head=False):
+    """ Calculate the md5 and sha1 of an open ``file``. Returns a tuple of
+    ``(md5, sha1, size, head)``. With ``want_head``, ``head`` holds the
+    first ``MAGIC_READ_LIMIT`` bytes, for libmagic; otherwise it's ``None``.
+
+    If ``file`` is on disk, it's mapped into memory instead of copied
+    through read buffers. Large files are hashed with md5 and sha1 running
+    in parallel. If ``spool`` is given, a copy of the file is written to it.
+    """
+    hashes = (hashlib.md5(), hashlib.sha1())
+    head = None
+    fileno = _fileno(file) if spool is None else None
+    size = os.fstat(fileno).st_size if fileno is not None else 0
+    # the executor only starts its thread when a large block comes along
+    executor = ThreadPoolExecutor(1) if parallel else None
+
+    try:
+        if size:
+            with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    if want_head:
+                        head = bytes(view[:MAGIC_READ_LIMIT])
+                    _update(hashes, _mmap_blocks(view, size), executor)
+                finally:
+                    view.release()
+
+        else:
+            if want_head:
+                head = bytearray()
+            for block in _read_blocks(file, spool, head):
+                size += len(block)
+                _update(hashes, [block], executor)
+
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    md5, sha1 = hashes
+    return (md5.hexdigest(), sha1.hexdigest(), size, head)
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from ... import cache
+from ... import digest  # noqa: defines the caches
+
+MB = 1024 * 1024
+
+def _mb(size):
+    return "%.1f MB" % (size / MB)
+
+class Command(BaseCommand):
+
+    help = ("Report the size of each cache, and of the stored content and "
+            "container members, and evict entries that were not used "
+            "recently, within the budgets in SNOOP_CACHE_GC")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+            help="Only report what would be evicted")
+        parser.add_argument('--max-age', type=float, default=None,
+            help="Override max_age (in days) for all caches")
+        parser.add_argument('--max-size', type=int, default=None,
+            help="Override max_size (in MB) for all caches")
+        parser.add_argument('names', nargs='*',
+            help="Caches or tables to collect; all of them by default")
+
+    def handle(self, dry_run, max_age, max_size, names, **options):
+        stores = {name: c.tiers[1:] for name, c in cache.caches.items()}
+        stores.update({name: [t] for name, t in cache.tables.items()})
+
+        for name in names or sorted(stores):
+            budget = cache.budget(name)
+            if max_age is not None:
+                budget['max_age'] = max_age
+            if max_size is not None:
+                budget['max_size'] = max_size * MB
+
+            for tier in stores[name]:
+                usage = tier.usage()
+                line = "%-10s %-4s %9d entries %12s" % (
+                    name, tier.name, usage['entries'], _mb(usage['bytes']))
+                if 'table_bytes' in usage:
+                    line += " (table %s)" % _mb(usage['table_bytes'])
+                print(line)
+
+                count, size = tier.gc(dry_run=dry_run, **budget)
+                if count:
+                    print("%-15s %s %d entries, %s" % (
+                        '', "would evict" if dry_run else "evicted",
+                        count, _mb(size)))
+
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW shared_buffers")
+            print("shared_buffers:", cursor.fetchone()[0])
@@ -0,0 +1,73 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from psycopg2 import Binary
+from psycopg2.extras import execute_values
+from ...compression import plain_fields, encode
+
+SELECT_SQL = (
+    "SELECT {pk}, {plain} FROM {table} "
+    "WHERE {pk} > %s AND {plain} IS NOT NULL "
+    "ORDER BY {pk} LIMIT %s"
+)
+
+# a row that got a compressed value since keeps it
+UPDATE_SQL = (
+    "UPDATE {table} SET {column} = coalesce({table}.{column}, v.data), "
+    "{plain} = NULL "
+    "FROM (VALUES %s) AS v(pk, data) WHERE {table}.{pk} = v.pk"
+)
+
+def compressed_fields():
+    for model in apps.get_app_config('snoop').get_models():
+        for field, plain in plain_fields(model):
+            yield model, field, plain
+
+def reencode(model, field, plain, batch):
+    """ Compress the values that were stored as plain text, ``batch`` rows
+    at a time, and move them to the compressed column. Returns the number
+    of rows and the bytes saved. """
+    names = {
+        'table': model._meta.db_table,
+        'pk': model._meta.pk.column,
+        'column': field.column,
+        'plain': plain.column,
+    }
+    select_sql = SELECT_SQL.format(**names)
+    update_sql = UPDATE_SQL.format(**names)
+    count = saved = 0
+    first = '' if model._meta.pk.get_internal_type() == 'CharField' else 0
+
+    with connection.cursor() as cursor:
+        while True:
+            with transaction.atomic():
+                cursor.execute(select_sql, [first, batch])
+                rows = cursor.fetchall()
+                if not rows:
+                    return (count, saved)
+
+                values = []
+                for pk, text in rows:
+                    encoded = encode(text)
+                    saved += len(text.encode('utf8')) - len(encoded)
+                    values.append((pk, Binary(encoded)))
+                execute_values(cursor, update_sql, values)
+
+            count += len(rows)
+            first = rows[-1][0]
+            print(model.__name__, count, "rows,", saved // 1024, "KB saved")
+
+class Command(BaseCommand):
+
+    help = ("Compress the values stored before their columns were "
+            "compressed")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000,
+            help="Re-encode this many rows per transaction")
+
+    def handle(self, batch, **options):
+        for model, field, plain in compressed_fields():
+            count, saved = reencode(model, field, plain, batch)
+            print(model.__name__, field.name, "done:", count, "rows,",
+                  saved // 1024, "KB saved")
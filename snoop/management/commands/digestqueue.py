@@ -1,4 +1,6 @@
 import simplejson as json
+from time import time
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from ... import models
 from ... import queues
@@ -11,10 +13,28 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--where', default='true',
             help='SQL "WHERE" clause on the snoop_document table')
+        parser.add_argument('--in-db', action='store_true', dest='in_db',
+            help='Queue the documents with a single INSERT ... SELECT, '
+                 'without loading them in Python')
+        parser.add_argument('--refresh', action='store_true',
+            help="Digest the documents' content again instead of reusing "
+                 "the stored content, e.g. after fixing a backend")
 
-    def handle(self, where, verbosity, **options):
-        query = utils.build_raw_query('snoop_document', where)
-        for document in models.Document.objects.raw(query):
-            queues.put('digest', {'id': document.id}, verbose=verbosity>0)
-            if verbosity > 0:
-                print(document.id)
+    def handle(self, where, in_db, refresh, verbosity, **options):
+        if in_db:
+            t0 = time()
+            data = "jsonb_build_object('id', id)"
+            if refresh:
+                data = "jsonb_build_object('id', id, 'refresh', true)"
+            fields = [data, models.DIGEST_PRIORITY_SQL, 'collection_id']
+            query = utils.build_raw_query('snoop_document', where, fields)
+            params = [models.FOLDER, settings.SNOOP_SMALL_FILE_SIZE]
+            count = queues.put_query('digest', query, params)
+            print('added', count, 'jobs to digest in',
+                  '{:.1f}'.format(time() - t0), 'seconds')
+            return
+
+        fields = ['id', 'collection_id', 'content_type', 'disk_size']
+        query = utils.build_raw_query('snoop_document', where, fields)
+        documents = models.Document.objects.raw(query)
+        queues.put_documents(documents, verbose=verbosity>0, refresh=refresh)
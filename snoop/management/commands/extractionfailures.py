@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from ... import models
+from ... import queues
+
+class Command(BaseCommand):
+
+    help = ("List the content that backends failed on, or forget it and "
+            "digest the documents again")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', default=None,
+            help="Only consider failures of this backend")
+        parser.add_argument('--error', default=None,
+            help="Only consider failures with this error class")
+        parser.add_argument('--retry', action='store_true',
+            help="Forget the failures and queue the documents again, "
+                 "e.g. after upgrading a backend")
+
+    def handle(self, backend, error, retry, verbosity, **options):
+        failed = models.ExtractionFailure.objects.all()
+        if backend:
+            failed = failed.filter(backend=backend)
+        if error:
+            failed = failed.filter(error=error)
+
+        if retry:
+            with transaction.atomic():
+                documents = models.Document.objects.filter(
+                    sha1__in=failed.values('sha1'),
+                    deleted=False,
+                )
+                count = queues.put_documents(documents.iterator())
+                failed.delete()
+            print("queued", count, "documents")
+            return
+
+        errors = (
+            failed
+            .values('backend', 'version', 'error')
+            .annotate(count=Count('id'))
+            .order_by('-count')
+        )
+        for row in errors:
+            print(row['count'], row['backend'], row['version'] or '-',
+                  row['error'])
+            if verbosity > 1:
+                query = failed.filter(backend=row['backend'],
+                                      version=row['version'],
+                                      error=row['error'])
+                for failure in query:
+                    print('   ', failure.sha1, failure.message[:100])
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from ... import models
+from ... import queues
+
+class Command(BaseCommand):
+
+    help = "List jobs that ran out of attempts, or queue them again"
+
+    def add_arguments(self, parser):
+        parser.add_argument('queue')
+        parser.add_argument('--retry', action='store_true',
+            help="Move the failed jobs back into the queue")
+        parser.add_argument('--error', default=None,
+            help="Only consider jobs whose error starts with this text")
+
+    def handle(self, queue, retry, error, verbosity, **options):
+        failed = models.FailedJob.objects.filter(queue=queue)
+        if error:
+            failed = failed.filter(error__startswith=error)
+
+        if retry:
+            count = queues.requeue(failed)
+            print("queued", count, "jobs")
+            return
+
+        errors = (
+            failed
+            .values('error')
+            .annotate(count=Count('id'))
+            .order_by('-count')
+        )
+        for row in errors:
+            print(row['count'], row['error'])
+            if verbosity > 1:
+                for job in failed.filter(error=row['error']):
+                    print('   ', job.time.isoformat(), job.data)
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import tempfile
+from time import time
+from django.core.management.base import BaseCommand, CommandError
+from ... import hashing
+from ...utils import chunks
+
+MB = 1024 * 1024
+
+def hash_chunks(file):
+    """ How documents were hashed before: 64K reads, one hash after the
+    other. """
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    for data in chunks(file):
+        md5.update(data)
+        sha1.update(data)
+    return (md5.hexdigest(), sha1.hexdigest())
+
+METHODS = [
+    ('chunks', hash_chunks),
+    ('mmap', lambda f: hashing.hash_file(f, parallel=False)[:2]),
+    ('mmap+threads', lambda f: hashing.hash_file(f)[:2]),
+]
+
+class Command(BaseCommand):
+
+    help = ("Measure how fast files are hashed, in MB/s. The test files "
+            "are in the page cache, so this measures the CPU, not the disk.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,16,256,1024',
+            help="Comma-separated file sizes, in MB")
+        parser.add_argument('--dir', default=None,
+            help="Where to write the test files")
+        parser.add_argument('--repeat', type=int, default=3,
+            help="Hash each file this many times and keep the best time")
+
+    def handle(self, sizes, dir, repeat, **options):
+        print("%10s %14s %10s" % ("size (MB)", "method", "MB/s"))
+        for size in [int(s) for s in sizes.split(',')]:
+            with tempfile.NamedTemporaryFile(dir=dir) as tmp:
+                for _ in range(size):
+                    tmp.write(os.urandom(MB))
+                tmp.flush()
+
+                results = set()
+                for name, method in METHODS:
+                    best = None
+                    for _ in range(repeat):
+                        with open(tmp.name, 'rb') as f:
+                            t0 = time()
+                            results.add(method(f))
+                            elapsed = time() - t0
+                        best = elapsed if best is None else min(best, elapsed)
+                    print("%10d %14s %10.1f" % (size, name, size / best))
+
+                if len(results) != 1:
+                    raise CommandError("The methods disagree on the hashes "
+                                       "of the %d MB file" % size)
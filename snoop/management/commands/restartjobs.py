@@ -1,5 +1,6 @@
 import simplejson as json
 from django.core.management.base import BaseCommand
+from django.utils import timezone
 from ... import models
 
 class Command(BaseCommand):
@@ -8,12 +9,16 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('queue')
+        parser.add_argument('--expired', action='store_true',
+            help="Only reset jobs whose worker stopped renewing the lease")
 
-    def handle(self, queue, verbosity, **options):
-        rows = (
+    def handle(self, queue, expired, verbosity, **options):
+        query = (
             models.Job
             .objects
             .filter(queue=queue, started=True)
-            .update(started=False)
         )
+        if expired:
+            query = query.filter(lease_expires__lt=timezone.now())
+        rows = query.update(started=False, worker='', lease_expires=None)
         print("updated", rows, "rows")
@@ -2,6 +2,7 @@ import sys
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from ...walker import Walker
+from ...watcher import Watcher
 from ... import models
 
 class Command(BaseCommand):
@@ -11,17 +12,37 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('collection_slug')
         parser.add_argument('prefix', nargs='?', default=None)
+        parser.add_argument('--jobs', type=int, default=None,
+            help='Walk this many folders at once, in threads')
+        parser.add_argument('--resume', action='store_true',
+            help='Continue an interrupted walk from where it stopped')
+        parser.add_argument('--watch', action='store_true',
+            help='After the walk, keep watching for changes on disk')
 
-    def handle(self, collection_slug, prefix, **options):
+    def handle(self, collection_slug, prefix, jobs, resume, watch,
+               **options):
         try:
             collection = models.Collection.objects.get(slug=collection_slug)
         except models.Collection.DoesNotExist:
             print("Collection with slug", collection_slug, "does not exist.")
             sys.exit(1)
 
+        if resume and jobs:
+            print("--resume only works with a serial walk, not with --jobs.")
+            sys.exit(1)
+
+        if watch:
+            watcher = Watcher(collection, prefix)
+            watcher.start()
+
         Walker.walk(
             root=collection.path,
             prefix=prefix,
             container_doc=None,
-            collection=collection
+            collection=collection,
+            jobs=jobs,
+            resume=resume,
         )
+
+        if watch:
+            watcher.run()
@@ -1,15 +1,27 @@
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from ... import queues
+from ... import pool
+from ... import cache
 from ...utils import worker_metrics
 
-def run_worker(worker, queue_name, queue_iterator, verbose):
+def run_worker(worker, queue_name, queue_iterator, verbose, max_jobs=None):
+    """ Run jobs from ``queue_iterator`` until the queue is empty, or
+    ``max_jobs`` have been processed. Returns the number of jobs. """
     with worker_metrics(type='job', queue=queue_name) as metrics:
         num_items = 0
-        for work in queue_iterator:
-            with work() as data:
-                num_items += 1
-                worker(verbose=verbose, **data)
+        try:
+            for work in queue_iterator:
+                with work() as data:
+                    num_items += 1
+                    worker(verbose=verbose, **data)
+                if max_jobs and num_items >= max_jobs:
+                    break
+        finally:
+            queue_iterator.close()
         metrics['items'] = num_items
+        metrics['cache'] = cache.stats()
+    return num_items
 
 class Command(BaseCommand):
 
@@ -18,10 +30,24 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('queue')
         parser.add_argument('-x', action='store_true', dest='stop_first_error')
+        parser.add_argument('--batch', type=int, default=1,
+            help='Number of jobs to claim from the queue at once')
+        parser.add_argument('--wait', action='store_true', dest='wait_for_jobs',
+            help='Keep running and wait for new jobs when the queue is empty')
+        parser.add_argument('--processes', type=int, default=None,
+            help='Run this many worker processes, forked from this one')
+        parser.add_argument('--threads', type=int, default=None,
+            help='Run this many jobs at once in each process, in threads')
+        parser.add_argument('--max-jobs', type=int, default=None,
+            dest='max_jobs',
+            help='Replace a worker process after it ran this many jobs '
+                 '(per thread)')
 
-    def handle(self, verbosity, queue, stop_first_error, **options):
+    def handle(self, verbosity, queue, stop_first_error, batch, wait_for_jobs,
+               processes, threads, max_jobs, **options):
+        prefetch = None
         if queue == 'digest':
-            from ...digest import worker
+            from ...digest import worker, prefetch
         elif queue == 'ocr':
             from ...ocr import worker
         elif queue == 'hotfix':
@@ -29,11 +55,28 @@ class Command(BaseCommand):
         else:
             raise ValueError("Unknown queue %r" % queue)
 
-        queue_iterator = queues.iterate(
-            queue,
-            verbose=verbosity > 0,
-            stop_first_error=stop_first_error,
-            in_order=stop_first_error,
-        )
+        def run():
+            queue_iterator = queues.iterate(
+                queue,
+                verbose=verbosity > 0,
+                stop_first_error=stop_first_error,
+                in_order=stop_first_error,
+                batch=batch,
+                wait_for_jobs=wait_for_jobs,
+                on_claim=prefetch,
+                stop=pool.stopping,
+            )
 
-        run_worker(worker, queue, queue_iterator, verbosity>0)
+            num_items = run_worker(worker, queue, queue_iterator,
+                                   verbosity>0, max_jobs)
+            return bool(max_jobs) and num_items >= max_jobs
+
+        target = run
+        if threads:
+            target = lambda: pool.threaded(run, threads)
+
+        if processes:
+            pool.prefork(target, processes, verbose=verbosity > 0,
+                         stop_timeout=settings.SNOOP_WORKER_STOP_TIMEOUT)
+        else:
+            target()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:38
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+sql_forward = """\
+UPDATE snoop_job
+    SET collection_id = snoop_document.collection_id
+    FROM snoop_document
+    WHERE snoop_job.queue = 'digest'
+        AND snoop_document.id = (snoop_job.data->>'id')::int
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0012_job_lease'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='snoop.Collection'),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterIndexTogether(
+            name='job',
+            index_together=set([('queue', 'collection', 'priority'), ('queue', 'started')]),
+        ),
+        migrations.RunSQL(sql_forward, migrations.RunSQL.noop),
+    ]
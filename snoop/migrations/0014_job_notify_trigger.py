@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:39
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+sql_forward = """\
+CREATE FUNCTION snoop_job_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('snoop_job', NEW.queue);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER snoop_job_notify
+    AFTER INSERT OR UPDATE OF started ON snoop_job
+    FOR EACH ROW WHEN (NOT NEW.started)
+    EXECUTE PROCEDURE snoop_job_notify();
+"""
+
+
+sql_reverse = """\
+DROP TRIGGER snoop_job_notify ON snoop_job;
+DROP FUNCTION snoop_job_notify();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0013_job_priority_collection'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql_forward, sql_reverse),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:41
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0014_job_notify_trigger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FailedJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('queue', models.CharField(max_length=100)),
+                ('data', django.contrib.postgres.fields.jsonb.JSONField(null=True)),
+                ('attempts', models.IntegerField()),
+                ('error', models.TextField()),
+                ('traceback', models.TextField(blank=True)),
+                ('time', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='job',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='failedjob',
+            index_together=set([('queue', 'time')]),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0015_job_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolderManifest',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='manifest', serialize=False, to='snoop.Document')),
+                ('mtime', models.FloatField()),
+                ('entries', models.IntegerField()),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('time', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
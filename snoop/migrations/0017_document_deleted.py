@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0016_folder_manifest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='deleted',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:50
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0017_document_deleted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalkCursor',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(blank=True, max_length=4000)),
+                ('path', models.CharField(max_length=4000)),
+                ('time', models.DateTimeField(auto_now=True)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='snoop.Collection')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='walkcursor',
+            unique_together=set([('collection', 'prefix')]),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0018_walk_cursor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContentDigest',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha1', models.CharField(max_length=50)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('data', models.TextField()),
+                ('time', models.DateTimeField(auto_now_add=True)),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='snoop.Collection')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentdigest',
+            unique_together=set([('collection', 'sha1', 'content_type')]),
+        ),
+    ]
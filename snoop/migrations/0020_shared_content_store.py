@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 20:56
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0019_content_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContainerMember',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('container_sha1', models.CharField(max_length=50)),
+                ('path', models.CharField(max_length=4000)),
+                ('sha1', models.CharField(max_length=50)),
+                ('md5', models.CharField(max_length=40)),
+                ('size', models.BigIntegerField()),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentdigest',
+            unique_together=set([]),
+        ),
+        # collections with the same content now share one row
+        migrations.RunSQL(
+            "DELETE FROM snoop_contentdigest d "
+            "USING snoop_contentdigest keep "
+            "WHERE d.sha1 = keep.sha1 "
+            "AND d.content_type = keep.content_type "
+            "AND d.id > keep.id",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RemoveField(
+            model_name='contentdigest',
+            name='collection',
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentdigest',
+            unique_together=set([('sha1', 'content_type')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='containermember',
+            unique_together=set([('container_sha1', 'path')]),
+        ),
+    ]
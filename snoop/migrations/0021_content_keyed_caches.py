@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0020_shared_content_store'),
+    ]
+
+    operations = [
+        # both caches were keyed by document id; now they're keyed by
+        # content hash, so the old entries would never be hit again
+        migrations.DeleteModel(
+            name='EmailCache',
+        ),
+        migrations.CreateModel(
+            name='EmailCache',
+            fields=[
+                ('key', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('value', models.TextField()),
+                ('time', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunSQL(
+            "DELETE FROM snoop_htmltextcache",
+            migrations.RunSQL.noop,
+        ),
+    ]
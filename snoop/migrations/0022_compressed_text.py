@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import snoop.compression
+
+def _compress(model_name, name, table, column):
+    # Changing the type of the column would rewrite the whole table under an
+    # exclusive lock. Instead, the text column is renamed, and the compressed
+    # values go into a new column; both are quick, whatever the size of the
+    # table. `compressdata` moves the old rows over later, while snoop runs.
+    # Going back only works before any row has a compressed value.
+    plain = snoop.compression.plain_name(column)
+    return migrations.SeparateDatabaseAndState(
+        database_operations=[
+            migrations.RunSQL(
+                [
+                    "ALTER TABLE {0} RENAME COLUMN {1} TO {2}"
+                    .format(table, column, plain),
+                    "ALTER TABLE {0} ALTER COLUMN {1} DROP NOT NULL"
+                    .format(table, plain),
+                    "ALTER TABLE {0} ADD COLUMN {1} bytea"
+                    .format(table, column),
+                ],
+                [
+                    "ALTER TABLE {0} DROP COLUMN {1}".format(table, column),
+                    "ALTER TABLE {0} RENAME COLUMN {1} TO {2}"
+                    .format(table, plain, column),
+                    "ALTER TABLE {0} ALTER COLUMN {1} SET NOT NULL"
+                    .format(table, column),
+                ],
+            ),
+        ],
+        state_operations=[
+            migrations.AlterField(
+                model_name=model_name,
+                name=name,
+                field=snoop.compression.CompressedTextField(null=True),
+            ),
+            migrations.AddField(
+                model_name=model_name,
+                name=snoop.compression.plain_name(name),
+                field=models.TextField(editable=False, null=True),
+            ),
+        ],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0021_content_keyed_caches'),
+    ]
+
+    operations = [
+        _compress('digest', 'data', 'snoop_digest', 'data'),
+        _compress('contentdigest', 'data', 'snoop_contentdigest', 'data'),
+        _compress('tikacache', 'value', 'snoop_tikacache', 'value'),
+        _compress('emailcache', 'value', 'snoop_emailcache', 'value'),
+    ]
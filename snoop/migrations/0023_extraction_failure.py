@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 21:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0022_compressed_text'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExtractionFailure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha1', models.CharField(max_length=50)),
+                ('backend', models.CharField(max_length=50)),
+                ('error', models.CharField(max_length=200)),
+                ('message', models.TextField(blank=True)),
+                ('flag', models.CharField(blank=True, max_length=100)),
+                ('version', models.CharField(blank=True, max_length=100)),
+                ('time', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='extractionfailure',
+            unique_together=set([('sha1', 'backend')]),
+        ),
+    ]
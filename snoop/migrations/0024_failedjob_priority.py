@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 21:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0023_extraction_failure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='failedjob',
+            name='collection',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='snoop.Collection'),
+        ),
+        migrations.AddField(
+            model_name='failedjob',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+    ]
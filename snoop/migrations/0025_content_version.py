@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 21:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0024_failedjob_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='containermember',
+            name='time',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='contentdigest',
+            name='version',
+            field=models.CharField(blank=True, max_length=40),
+        ),
+        migrations.AlterField(
+            model_name='contentdigest',
+            name='time',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='contentdigest',
+            unique_together=set([('sha1', 'content_type', 'version')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 21:31
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('snoop', '0025_content_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digest',
+            name='version',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# for `queues.PENDING_COLLECTIONS_SQL`; built concurrently, so that workers
+# can keep using the table in the meantime
+sql_forward = """\
+CREATE INDEX CONCURRENTLY snoop_job_pending
+    ON snoop_job (queue, collection_id, priority, not_before)
+    WHERE NOT started
+"""
+
+
+sql_reverse = """\
+DROP INDEX CONCURRENTLY snoop_job_pending
+"""
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('snoop', '0026_digest_version'),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql_forward, sql_reverse),
+    ]
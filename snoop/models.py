@@ -1,43 +1,18 @@
 from pathlib import Path
 from io import BytesIO
-import json
 from contextlib import contextmanager
 import tempfile
 import shutil
-from django.db import models, transaction
+from django.db import models
 from django.contrib.postgres.fields import JSONField
 from django.conf import settings
+from .compression import CompressedTextField, CompressedModel
 
-def cache(model, keyfunc):
-
-    def decorator(func):
-
-        if not settings.SNOOP_CACHE:
-            return func
-
-        @transaction.atomic
-        def wrapper(*args, **kwargs):
-            key = keyfunc(*args, **kwargs)
-
-            row, created = model.objects.get_or_create(pk=key)
-            if not created:
-                return json.loads(row.value)
-
-            value = func(*args, **kwargs)
-
-            row.value = json.dumps(value)
-            row.save()
-
-            return value
-
-        wrapper.no_cache = func
-        return wrapper
-
-    return decorator
-
-class EmailCache(models.Model):
-    id = models.IntegerField(primary_key=True)
-    value = models.TextField()
+class EmailCache(CompressedModel):
+    key = models.CharField(max_length=100, primary_key=True)
+    value = CompressedTextField(null=True)
+    # written before `value` was compressed; `compressdata` moves it
+    value_plain = models.TextField(null=True, editable=False)
     time = models.DateTimeField(auto_now=True)
 
 class Collection(models.Model):
@@ -51,6 +26,16 @@ class Collection(models.Model):
     def __str__(self):
         return self.slug
 
+FOLDER = 'application/x-directory'
+
+# takes ``FOLDER`` and ``SNOOP_SMALL_FILE_SIZE`` as parameters
+DIGEST_PRIORITY_SQL = """\
+CASE
+    WHEN content_type = %s THEN 2
+    WHEN disk_size <= %s THEN 1
+    ELSE 0
+END"""
+
 class Document(models.Model):
     collection = models.ForeignKey('Collection')
     container = models.ForeignKey('Document',
@@ -69,6 +54,7 @@ class Document(models.Model):
     rev = models.IntegerField(null=True)
     flags = JSONField(default=dict, blank=True)
     digested_at = models.DateTimeField(null=True, blank=True)
+    deleted = models.BooleanField(default=False)
 
     class Meta:
         # TODO: constraint does not apply to container=None rows
@@ -78,13 +64,23 @@ class Document(models.Model):
     def __str__(self):
         return str(self.path)
 
+    @property
+    def digest_priority(self):
+        """ Folders and small files jump ahead of large files in the digest
+        queue. Keep in sync with ``DIGEST_PRIORITY_SQL``. """
+        if self.content_type == FOLDER:
+            return 2
+        if self.disk_size <= settings.SNOOP_SMALL_FILE_SIZE:
+            return 1
+        return 0
+
     @property
     def absolute_path(self):
         assert self.container is None
         return Path(self.collection.path) / self.path
 
     def _open_file(self):
-        if self.content_type == 'application/x-directory':
+        if self.content_type == FOLDER:
             return BytesIO()
 
         if self.container is None:
@@ -104,6 +100,18 @@ class Document(models.Model):
 
         raise RuntimeError
 
+    # a copy of the document's content, set while it's being digested
+    spool = None
+
+    @contextmanager
+    def _opened(self):
+        if self.spool is not None:
+            self.spool.seek(0)
+            yield self.spool
+        else:
+            with self._open_file() as f:
+                yield f
+
     @contextmanager
     def open(self, filesystem=False):
         """ Open the document as a file. If the document is inside an email or
@@ -116,7 +124,7 @@ class Document(models.Model):
         is the absolute path of the file on disk.
         """
 
-        with self._open_file() as f:
+        with self._opened() as f:
             if filesystem:
                 if self.container:
                     MB = 1024*1024
@@ -134,6 +142,31 @@ class Document(models.Model):
             else:
                 yield f
 
+class FolderManifest(models.Model):
+    """ What a folder looked like when the walker last synced it. """
+    document = models.OneToOneField(
+        'Document',
+        primary_key=True,
+        related_name='manifest',
+    )
+    mtime = models.FloatField()
+    entries = models.IntegerField()
+    fingerprint = models.CharField(max_length=40)
+    time = models.DateTimeField(auto_now=True)
+
+    def as_tuple(self):
+        return (self.mtime, self.entries, self.fingerprint)
+
+class WalkCursor(models.Model):
+    """ The last folder synced by a walk, to resume it from there. """
+    collection = models.ForeignKey('Collection')
+    prefix = models.CharField(max_length=4000, blank=True)
+    path = models.CharField(max_length=4000)
+    time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('collection', 'prefix')
+
 class Ocr(models.Model):
     collection = models.ForeignKey(
         'Collection',
@@ -151,22 +184,95 @@ class Ocr(models.Model):
     def absolute_path(self):
         return Path(self.collection.ocr[self.tag]) / self.path
 
-class Digest(models.Model):
+class Digest(CompressedModel):
     id = models.IntegerField(primary_key=True)
-    data = models.TextField()
+    # see `digest.content_version`; moved documents only reuse digests with
+    # the current version
+    version = models.CharField(max_length=40, null=True, blank=True)
+    data = CompressedTextField(null=True)
+    # written before `data` was compressed; `compressdata` moves it
+    data_plain = models.TextField(null=True, editable=False)
+
+class ContentDigest(CompressedModel):
+    """ The part of a digest that only depends on the content, shared by
+    all documents with the same sha1 and content type, in any collection. """
+    sha1 = models.CharField(max_length=50)
+    content_type = models.CharField(max_length=100, blank=True)
+    # see `digest.content_version`
+    version = models.CharField(max_length=40, blank=True)
+    data = CompressedTextField(null=True)
+    # written before `data` was compressed; `compressdata` moves it
+    data_plain = models.TextField(null=True, editable=False)
+    time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('sha1', 'content_type', 'version')
+
+class ContainerMember(models.Model):
+    """ The hashes of a file found at ``path`` inside the email or archive
+    with ``container_sha1``. The same container, in any collection, has the
+    same members, so they don't need to be extracted again to be hashed. """
+    container_sha1 = models.CharField(max_length=50)
+    path = models.CharField(max_length=4000)
+    sha1 = models.CharField(max_length=50)
+    md5 = models.CharField(max_length=40)
+    size = models.BigIntegerField()
+    content_type = models.CharField(max_length=100, blank=True)
+    time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('container_sha1', 'path')
+
+class ExtractionFailure(models.Model):
+    """ A backend that failed on the content with ``sha1``. Until the
+    backend's version changes, the content is not sent to it again. """
+    sha1 = models.CharField(max_length=50)
+    backend = models.CharField(max_length=50)
+    error = models.CharField(max_length=200)
+    message = models.TextField(blank=True)
+    flag = models.CharField(max_length=100, blank=True)
+    version = models.CharField(max_length=100, blank=True)
+    time = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('sha1', 'backend')
 
 class Job(models.Model):
     queue = models.CharField(max_length=100)
     data = JSONField(null=True)
     started = models.BooleanField(default=False)
+    worker = models.CharField(max_length=200, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    priority = models.IntegerField(default=0)
+    collection = models.ForeignKey('Collection', null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    not_before = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ('queue', 'data')
-        index_together = ('queue', 'started')
+        index_together = [
+            ('queue', 'started'),
+            ('queue', 'collection', 'priority'),
+        ]
 
-class TikaCache(models.Model):
+class FailedJob(models.Model):
+    queue = models.CharField(max_length=100)
+    data = JSONField(null=True)
+    attempts = models.IntegerField()
+    error = models.TextField()
+    traceback = models.TextField(blank=True)
+    time = models.DateTimeField(auto_now_add=True)
+    priority = models.IntegerField(default=0)
+    collection = models.ForeignKey('Collection', null=True, blank=True)
+
+    class Meta:
+        index_together = ('queue', 'time')
+
+class TikaCache(CompressedModel):
     sha1 = models.CharField(max_length=50, primary_key=True)
-    value = models.TextField()
+    value = CompressedTextField(null=True)
+    # written before `value` was compressed; `compressdata` moves it
+    value_plain = models.TextField(null=True, editable=False)
     time = models.DateTimeField(auto_now=True)
 
 class TikaLangCache(models.Model):
@@ -26,17 +26,17 @@ def walk(collection, tag, path, verbose=False):
                 yield (md5, item)
 
     ocr_root = Path(path)
-    for i, (md5, path) in enumerate(_traverse(ocr_root), 1):
-        job = {
+    jobs = (
+        {
             'collection_id': collection.id,
             'ocr_root': str(ocr_root),
             'tag': tag,
             'md5': md5,
             'path': str(path.relative_to(ocr_root)),
         }
-        queues.put('ocr', job, verbose=verbose)
-
-    if verbose: print('added', i, 'jobs to queue')
+        for md5, path in _traverse(ocr_root)
+    )
+    queues.put_many('ocr', jobs, verbose=verbose, collection_id=collection.id)
 
 @transaction.atomic
 def worker(collection_id, ocr_root, tag, md5, path, verbose):
@@ -2,6 +2,7 @@ import re
 import gnupg
 from django.conf import settings
 from . import exceptions
+from .utils import backend_slot
 
 GPG = None
 
@@ -48,10 +49,11 @@ def decrypt_pgp_block(content, passphrase=None):
 
     gpg = _get_gpg()
 
-    if passphrase:
-        decrypt = gpg.decrypt(text_block, passphrase=passphrase)
-    else:
-        decrypt = gpg.decrypt(text_block)
+    with backend_slot('gpg'):
+        if passphrase:
+            decrypt = gpg.decrypt(text_block, passphrase=passphrase)
+        else:
+            decrypt = gpg.decrypt(text_block)
 
     if decrypt.ok:
         return decrypt.data
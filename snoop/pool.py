@@ -0,0 +1,141 @@
+import os
+import signal
+import sys
+import threading
+import traceback
+from time import sleep
+from django.db import connections
+
+# exit status of a child that wants to be replaced by a fresh process
+EXIT_RECYCLE = 3
+
+# set in a child when it's asked to stop; workers finish the jobs they are
+# running, and don't start new ones
+stopping = threading.Event()
+
+def _stop_child(signum, frame):
+    stopping.set()
+
+def _fork(target):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    # child process; never return to the caller. Ctrl-C reaches the whole
+    # process group, but only the parent decides when children stop.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _stop_child)
+    status = 1
+    try:
+        status = EXIT_RECYCLE if target() else 0
+    except Exception:
+        traceback.print_exc()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(status)
+
+def _kill(children):
+    for pid in list(children):
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+def prefork(target, processes, verbose=False, restart_delay=1,
+            stop_timeout=60):
+    """ Run ``target()`` in ``processes`` forked children.
+
+    Children are forked after Django is set up, so they share the loaded
+    code. A child whose ``target()`` returns a true value, or that crashes,
+    is replaced by a new one; a child that returns a false value is done
+    (e.g. its queue is empty). Returns when all children are done.
+
+    On SIGINT or SIGTERM, the children are asked to stop (they set
+    ``stopping``); the ones still running after ``stop_timeout`` seconds
+    are killed.
+    """
+    # children must not share the parent's database connections
+    connections.close_all()
+
+    children = set()
+    stop_requested = False
+    killer = threading.Timer(stop_timeout, _kill, [children])
+    killer.daemon = True
+
+    def stop(signum, frame):
+        nonlocal stop_requested
+        if stop_requested:
+            return
+        stop_requested = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+        killer.start()
+
+    previous_handlers = {
+        signum: signal.signal(signum, stop)
+        for signum in [signal.SIGINT, signal.SIGTERM]
+    }
+
+    try:
+        for _ in range(processes):
+            children.add(_fork(target))
+
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            children.discard(pid)
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else None
+
+            if stop_requested or code == 0:
+                if verbose: print('worker', pid, 'finished')
+                continue
+
+            if code == EXIT_RECYCLE:
+                if verbose: print('worker', pid, 'recycled')
+            else:
+                print('worker', pid, 'died with status', status)
+                sleep(restart_delay)
+
+            if not stop_requested:
+                children.add(_fork(target))
+
+    finally:
+        killer.cancel()
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+
+def threaded(target, threads):
+    """ Run ``target()`` in ``threads`` threads at once, and wait for them.
+
+    Django gives each thread its own database connection; it's closed when
+    the thread is done. Returns ``True`` if any of the calls returned a
+    true value. An exception in a thread is raised again once all threads
+    have finished.
+    """
+    results = []
+    errors = []
+
+    def run():
+        try:
+            results.append(target())
+        except Exception as e:
+            traceback.print_exc()
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    pool = [threading.Thread(target=run) for _ in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return any(results)
@@ -5,6 +5,8 @@ import tempfile
 from django.conf import settings
 import shutil
 from . import exceptions
+from . import failures
+from .utils import backend_slot
 from .walker import Walker
 
 KNOWN_TYPES = {
@@ -31,18 +33,27 @@ def _other_temps(sha1, current):
             return True
     return False
 
+@failures.version_detector('readpst')
+def readpst_version():
+    output = subprocess.run(
+        [settings.SNOOP_READPST_BINARY, '-V'],
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=10,
+    ).stdout
+    return output.decode().strip().splitlines()[0]
+
 def call_readpst(pst_path, output_dir):
     try:
-        subprocess.check_output([
-            settings.SNOOP_READPST_BINARY,
-            '-D',
-            '-M',
-            '-e',
-            '-o',
-            str(output_dir),
-            '-teajc',
-            str(pst_path),
-        ], stderr=subprocess.STDOUT)
+        with backend_slot('readpst'):
+            subprocess.check_output([
+                settings.SNOOP_READPST_BINARY,
+                '-D',
+                '-M',
+                '-e',
+                '-o',
+                str(output_dir),
+                '-teajc',
+                str(pst_path),
+            ], stderr=subprocess.STDOUT)
 
     except subprocess.CalledProcessError as e:
         raise PSTExtractionFailed('readpst failed: ' + e.output.decode())
@@ -54,6 +65,7 @@ def extract_to_base(doc):
     base = CACHE_ROOT / doc.sha1
     if base.is_dir():
         return
+    failures.check('readpst', doc.sha1)
 
     tmp = Path(tempfile.mkdtemp(
         prefix=doc.sha1,
@@ -69,8 +81,9 @@ def extract_to_base(doc):
         try:
             call_readpst(pst_file.path, tmp)
 
-        except Exception:
+        except Exception as e:
             tmp.rename(tmp.with_name('broken_' + tmp.name))
+            failures.record('readpst', doc.sha1, e)
             raise
 
         else:
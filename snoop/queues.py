@@ -1,76 +1,464 @@
-from contextlib import contextmanager
-from django.db import transaction, IntegrityError
+import os
+import select
+import socket
+import threading
+import traceback
+import uuid
+from itertools import islice
+from time import time
+from contextlib import contextmanager, ExitStack
+from psycopg2.extras import Json, execute_values
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
 from . import models
 
-def put(queue, data, verbose=False):
+PUT_CHUNK_SIZE = 5000
+
+INSERT_SQL = """\
+INSERT INTO snoop_job
+    (queue, data, started, worker, lease_expires, priority, collection_id,
+     attempts, not_before)
+    VALUES %s
+    ON CONFLICT DO NOTHING
+"""
+
+INSERT_TEMPLATE = "(%s, %s, false, '', NULL, %s, %s, 0, NULL)"
+
+INSERT_SELECT_SQL = """\
+INSERT INTO snoop_job
+    (queue, data, started, worker, lease_expires, priority, collection_id,
+     attempts, not_before)
+    SELECT %s, data, false, '', NULL, priority::int, collection_id::int,
+        0, NULL
+        FROM ({select}) AS jobs (data, priority, collection_id)
+    ON CONFLICT DO NOTHING
+"""
+
+CLAIM_SQL = """\
+UPDATE snoop_job
+    SET started = true,
+        worker = %(worker)s,
+        lease_expires = now() + %(lease)s * interval '1 second',
+        attempts = attempts + 1
+    WHERE id IN (
+        SELECT id FROM snoop_job
+            WHERE queue = %(queue)s
+                AND (NOT started OR lease_expires < now())
+                AND (not_before IS NULL OR not_before <= now())
+                {collection}
+            {order_by}
+            LIMIT %(batch)s
+            FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, data, priority, attempts, collection_id
+"""
+
+# Jobs that were never started are read from a partial index (migration
+# 0027), and the few started ones whose lease expired from the table.
+PENDING_COLLECTIONS_SQL = """\
+SELECT collection_id FROM (
+    SELECT collection_id, priority FROM snoop_job
+        WHERE queue = %(queue)s AND NOT started
+            AND (not_before IS NULL OR not_before <= now())
+    UNION ALL
+    SELECT collection_id, priority FROM snoop_job
+        WHERE queue = %(queue)s AND started AND lease_expires < now()
+            AND (not_before IS NULL OR not_before <= now())
+) AS pending
+    GROUP BY collection_id
+    ORDER BY max(priority) DESC, collection_id
+"""
+
+ALL_COLLECTIONS = object()
+
+# A trigger on snoop_job sends the queue name on this channel whenever a job
+# becomes available, see migration 0014.
+NOTIFY_CHANNEL = 'snoop_job'
+
+# seconds between checks for a stop request, while waiting for jobs
+STOP_CHECK_INTERVAL = 1
+
+RETRY_SQL = """\
+UPDATE snoop_job
+    SET started = false,
+        worker = '',
+        lease_expires = NULL,
+        not_before = now() + %(delay)s * interval '1 second'
+    WHERE id = %(id)s
+"""
+
+RENEW_SQL = """\
+UPDATE snoop_job
+    SET lease_expires = now() + %(lease)s * interval '1 second'
+    WHERE worker = %(worker)s AND started
+"""
+
+def worker_id():
+    """ A name for this worker that is unique across hosts and restarts. """
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                             uuid.uuid4().hex[:8])
+
+class Heartbeat(threading.Thread):
+    """ Background thread that keeps renewing the leases held by ``worker``.
+
+    Jobs whose worker dies stop being renewed; once their lease expires,
+    ``claim`` hands them out again.
+    """
+
+    def __init__(self, worker, lease=None):
+        super().__init__(daemon=True)
+        self.worker = worker
+        self.lease = lease or settings.SNOOP_JOB_LEASE
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(self.lease / 3):
+                try:
+                    renew(self.worker, self.lease)
+                except Exception as e:
+                    print('heartbeat failed:', type(e).__name__, e)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def renew(worker, lease=None):
+    with connection.cursor() as cursor:
+        cursor.execute(RENEW_SQL, {
+            'worker': worker,
+            'lease': lease or settings.SNOOP_JOB_LEASE,
+        })
+        return cursor.rowcount
+
+@contextmanager
+def heartbeat(worker):
+    beat = Heartbeat(worker)
+    beat.start()
     try:
-        models.Job.objects.create(queue=queue, data=data)
-    except IntegrityError:
-        if verbose: print('job already exists, skipping:', queue, data)
+        yield
+    finally:
+        beat.stop()
 
-def iterate(queue, verbose=False, stop_first_error=False, in_order=False):
+def _insert(queue, rows):
+    """ Insert ``(data, priority, collection_id)`` rows into ``queue`` with
+    one statement per chunk, skipping jobs that are already queued. Returns
+    the number of new jobs. """
+    rows = iter(rows)
+    count = 0
     while True:
-        with transaction.atomic():
-            try:
-                query = (
-                    models.Job.objects
-                    .select_for_update()
-                    .filter(queue=queue)
-                    .filter(started=False)
-                )
-                if in_order:
-                    query = query.order_by('id')
-                job = query[0]
-
-            except IndexError:
-                if verbose: print('No jobs available in', queue)
-                return
+        chunk = [
+            (queue, Json(data), priority, collection_id)
+            for data, priority, collection_id
+            in islice(rows, PUT_CHUNK_SIZE)
+        ]
+        if not chunk:
+            return count
 
-            job.started = True
-            job.save()
+        with connection.cursor() as cursor:
+            execute_values(cursor, INSERT_SQL, chunk,
+                           template=INSERT_TEMPLATE, page_size=len(chunk))
+            count += cursor.rowcount
 
-        if verbose: print(job.data)
+def put(queue, data, verbose=False, priority=0, collection_id=None):
+    if not _insert(queue, [(data, priority, collection_id)]):
+        if verbose: print('job already exists, skipping:', queue, data)
 
-        @contextmanager
-        def work():
-            try:
-                yield job.data
+def put_many(queue, iterable, verbose=False, priority=0, collection_id=None):
+    """ Add the job data from ``iterable`` to ``queue``, in large chunks.
+    Jobs that are already queued are skipped. """
+    rows = ((data, priority, collection_id) for data in iterable)
+    count = _insert(queue, rows)
+    if verbose: print('added', count, 'jobs to', queue)
+    return count
 
-            except Exception:
-                if stop_first_error:
-                    job.started = False
-                    job.save()
-                    raise
+def put_query(queue, select, params=()):
+    """ Queue the rows of a ``SELECT data, priority, collection_id`` query,
+    without leaving the database. Returns the number of new jobs. """
+    sql = INSERT_SELECT_SQL.format(select=select)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [queue] + list(params))
+        return cursor.rowcount
 
-                elif verbose:
-                    print('ERR')
+def put_documents(documents, verbose=False, refresh=False):
+    """ Add ``documents`` to the digest queue, in large chunks. With
+    ``refresh``, their content is digested again, not reused. """
+    extra = {'refresh': True} if refresh else {}
+    rows = (
+        (dict(id=doc.id, **extra), doc.digest_priority, doc.collection_id)
+        for doc in documents
+    )
+    count = _insert('digest', rows)
+    if verbose: print('added', count, 'jobs to digest')
+    return count
 
-            else:
-                # no error; delete the job
-                if verbose: print('OK')
-                job.delete()
+def claim(queue, batch=1, in_order=False, worker=None,
+          collection_id=ALL_COLLECTIONS):
+    """ Mark up to ``batch`` jobs as started by ``worker`` and return them.
 
-        yield work
+    Jobs that were never started, and jobs whose lease has expired because
+    their worker stopped renewing it, are both up for grabs. Rows locked by
+    other workers are skipped instead of waited on, so concurrent workers
+    never block each other while claiming. Higher priority jobs are claimed
+    first, unless ``in_order`` is set.
+    """
+    if collection_id is ALL_COLLECTIONS:
+        collection = ''
+    elif collection_id is None:
+        collection = 'AND collection_id IS NULL'
+    else:
+        collection = 'AND collection_id = %(collection_id)s'
+    sql = CLAIM_SQL.format(
+        collection=collection,
+        order_by='ORDER BY id' if in_order else 'ORDER BY priority DESC',
+    )
+    params = {
+        'queue': queue,
+        'batch': batch,
+        'worker': worker or worker_id(),
+        'lease': settings.SNOOP_JOB_LEASE,
+        'collection_id': collection_id,
+    }
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
 
-def bulk(queue, batch, verbose=False):
+    jobs = [
+        models.Job(id=id, queue=queue, data=data, started=True,
+                   worker=params['worker'], priority=priority,
+                   attempts=attempts, collection_id=job_collection_id)
+        for id, data, priority, attempts, job_collection_id in rows
+    ]
+    if in_order:
+        jobs.sort(key=lambda job: job.id)
+    else:
+        jobs.sort(key=lambda job: -job.priority)
+    return jobs
+
+class RoundRobin(object):
+    """ Claims jobs from each collection with pending jobs in turn, so a
+    huge collection can't starve the others.
+
+    The list of collections is refreshed every
+    ``SNOOP_QUEUE_SCHEDULE_REFRESH`` seconds, and whenever it runs out.
+    Collections with more urgent jobs get their turn first in each round.
+    """
+
+    def __init__(self, queue, refresh=None):
+        self.queue = queue
+        self.refresh = refresh or settings.SNOOP_QUEUE_SCHEDULE_REFRESH
+        self.collections = []
+        self.loaded_at = None
+
+    def reload(self):
+        with connection.cursor() as cursor:
+            cursor.execute(PENDING_COLLECTIONS_SQL, {'queue': self.queue})
+            self.collections = [row[0] for row in cursor.fetchall()]
+        self.loaded_at = time()
+
+    def claim(self, batch=1, in_order=False, worker=None):
+        if self.loaded_at is None or time() - self.loaded_at > self.refresh:
+            self.reload()
+
+        for attempt in range(2):
+            while self.collections:
+                collection_id = self.collections.pop(0)
+                jobs = claim(self.queue, batch, in_order, worker,
+                             collection_id)
+                if jobs:
+                    self.collections.append(collection_id)
+                    return jobs
+
+            if attempt == 0:
+                self.reload()
+
+        return []
+
+def listen():
+    """ Subscribe this connection to new job notifications. Call it before
+    looking for jobs, so that nothing queued in between is missed. """
+    with connection.cursor() as cursor:
+        cursor.execute('LISTEN ' + NOTIFY_CHANNEL)
+
+def wait(queue, timeout, stop=None):
+    """ Block until a job is queued in ``queue``, ``timeout`` seconds pass,
+    or the ``stop`` event is set. Requires a previous call to ``listen()``.
+    Returns ``True`` if woken up by a notification. """
+    pg_connection = connection.connection
+    deadline = time() + timeout
     while True:
-        with transaction.atomic():
-            query = (
-                models.Job.objects
-                .select_for_update()
-                .filter(queue=queue)
-                .filter(started=False)
+        notified = False
+        while pg_connection.notifies:
+            if pg_connection.notifies.pop(0).payload == queue:
+                notified = True
+        if notified:
+            return True
+
+        remaining = deadline - time()
+        if remaining <= 0 or _stopped(stop):
+            return False
+        if stop is not None:
+            remaining = min(remaining, STOP_CHECK_INTERVAL)
+
+        if select.select([pg_connection], [], [], remaining) != ([], [], []):
+            pg_connection.poll()
+
+def _stopped(stop):
+    return stop is not None and stop.is_set()
+
+def release(jobs):
+    """ Put claimed jobs back in the queue without running them. """
+    job_ids = [job.id for job in jobs]
+    (
+        models.Job.objects
+        .filter(id__in=job_ids)
+        .update(
+            started=False,
+            worker='',
+            lease_expires=None,
+            attempts=F('attempts') - 1,
+        )
+    )
+
+def retry_policy(queue):
+    policies = settings.SNOOP_QUEUE_RETRY
+    return dict(policies['default'], **policies.get(queue, {}))
+
+def fail(job, error, tb=''):
+    """ Record a failed attempt at ``job``. The job is retried after an
+    exponentially growing delay, until it runs out of attempts and moves
+    to the ``FailedJob`` table. Returns ``True`` if it will be retried. """
+    policy = retry_policy(job.queue)
+    if job.attempts < policy['attempts']:
+        delay = policy['backoff'] * 2 ** (job.attempts - 1)
+        with connection.cursor() as cursor:
+            cursor.execute(RETRY_SQL, {'id': job.id, 'delay': delay})
+        return True
+
+    with transaction.atomic():
+        models.FailedJob.objects.create(
+            queue=job.queue,
+            data=job.data,
+            attempts=job.attempts,
+            error=error,
+            traceback=tb,
+            priority=job.priority,
+            collection_id=job.collection_id,
+        )
+        models.Job.objects.filter(id=job.id).delete()
+    return False
+
+def requeue(failed):
+    """ Put the ``FailedJob`` rows of the ``failed`` query back in their
+    queues, with their priority and collection. Returns the number of jobs.
+    """
+    count = 0
+    with transaction.atomic():
+        for queue in failed.values_list('queue', flat=True).distinct():
+            rows = (
+                (job.data, job.priority, job.collection_id)
+                for job in failed.filter(queue=queue).iterator()
             )
-            jobs = list(query[:batch])
+            count += _insert(queue, rows)
+        failed.delete()
+    return count
 
-            if not jobs:
-                if verbose: print('No jobs available in', queue)
+def iterate(queue, verbose=False, stop_first_error=False, in_order=False,
+            batch=1, wait_for_jobs=False, on_claim=None, stop=None):
+    """ Claim and yield jobs from ``queue`` until it's empty. With
+    ``wait_for_jobs``, keep running and sleep until new jobs are queued.
+    Once the ``stop`` event is set, no more jobs are yielded, and the rest
+    of the batch is put back in the queue.
+    ``on_claim`` is called with the data of each batch of claimed jobs,
+    before they are yielded, and returns a context manager that stays open
+    while the batch is worked on; the worker can load what it needs for all
+    of them at once, and let go of it after. """
+    worker = worker_id()
+    with heartbeat(worker):
+        yield from _iterate(queue, worker, verbose, stop_first_error,
+                            in_order, batch, wait_for_jobs, on_claim, stop)
+
+def _iterate(queue, worker, verbose, stop_first_error, in_order, batch,
+             wait_for_jobs, on_claim, stop):
+    if wait_for_jobs:
+        listen()
+    schedule = RoundRobin(queue)
+    while not _stopped(stop):
+        jobs = schedule.claim(batch, in_order, worker)
+        if not jobs:
+            if verbose: print('No jobs available in', queue)
+            if not wait_for_jobs:
                 return
+            # also wake up now and then, for jobs with expired leases
+            wait(queue, settings.SNOOP_QUEUE_POLL_INTERVAL, stop)
+            continue
+
+        with ExitStack() as batch_context:
+            try:
+                if on_claim is not None:
+                    batch_context.enter_context(
+                        on_claim([job.data for job in jobs]))
+
+                while jobs and not _stopped(stop):
+                    job = jobs.pop(0)
+
+                    if job.attempts > retry_policy(queue)['attempts']:
+                        # earlier attempts died without reporting back
+                        fail(job, 'Lease expired')
+                        if verbose:
+                            print('lease expired, giving up:', job.data)
+                        continue
+
+                    if verbose: print(job.data)
+
+                    @contextmanager
+                    def work():
+                        try:
+                            yield job.data
+
+                        except Exception as e:
+                            if stop_first_error:
+                                release([job])
+                                raise
+
+                            error = '{}: {}'.format(type(e).__name__, e)
+                            retry = fail(job, error, traceback.format_exc())
+                            if verbose:
+                                print('ERR', error)
+                                print('retrying later' if retry
+                                      else 'giving up')
+
+                        else:
+                            # no error; delete the job
+                            if verbose: print('OK')
+                            job.delete()
+
+                    yield work
+
+            finally:
+                # the consumer or the worker stopped early; unclaim the rest
+                # of the batch
+                if jobs:
+                    release(jobs)
+
+def bulk(queue, batch, verbose=False):
+    worker = worker_id()
+    with heartbeat(worker):
+        yield from _bulk(queue, worker, batch, verbose)
+
+def _bulk(queue, worker, batch, verbose):
+    while True:
+        jobs = claim(queue, batch, worker=worker)
 
-            job_ids = [job.id for job in jobs]
-            job_collection = models.Job.objects.filter(id__in=job_ids)
+        if not jobs:
+            if verbose: print('No jobs available in', queue)
+            return
 
-            job_collection.update(started=True)
+        job_ids = [job.id for job in jobs]
+        job_collection = models.Job.objects.filter(id__in=job_ids)
 
         if verbose: print(len(job_ids), 'jobs')
 
@@ -79,8 +467,11 @@ def bulk(queue, batch, verbose=False):
             try:
                 yield [job.data for job in jobs]
 
-            except Exception:
-                print('ERR')
+            except Exception as e:
+                error = '{}: {}'.format(type(e).__name__, e)
+                print('ERR', error)
+                for job in jobs:
+                    fail(job, error, traceback.format_exc())
 
             else:
                 # no error; delete the job
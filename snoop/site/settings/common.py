@@ -66,6 +66,14 @@ LOGGING = {
 }
 
 SNOOP_CACHE = True
+SNOOP_CACHE_MEMORY_SIZE = 32 * 1024 * 1024 # 32M per cache, in each worker process
+SNOOP_CACHE_DISK_ROOT = None # set to a local folder to add a disk tier
+SNOOP_CACHE_TOUCH_INTERVAL = 24 * 3600 # seconds
+SNOOP_CACHE_GC = {
+    # `cachegc` removes entries not used for `max_age` days, then the least
+    # recently used ones until each cache fits in `max_size` bytes
+    'default': {'max_age': None, 'max_size': None},
+}
 
 SNOOP_ELASTICSEARCH_URL = 'http://localhost:9200'
 SNOOP_ELASTICSEARCH_INDEX = 'hoover'
@@ -75,6 +83,7 @@ SNOOP_ANALYZE_LANG = False
 SNOOP_TIKA_MAX_FILE_SIZE = 50 * 1024 * 1024 # 50M
 SNOOP_TIKA_FILE_TYPES = ['doc', 'pdf', 'xls', 'ppt']
 SNOOP_TIKA_SERVER_ENDPOINT = None
+SNOOP_TIKA_TIMEOUT = 300 # seconds to wait for tika's response
 
 SNOOP_MSGCONVERT_SCRIPT = None
 SNOOP_MSG_CACHE = None
@@ -89,6 +98,34 @@ SNOOP_READPST_BINARY = None
 SNOOP_GPG_HOME = None
 SNOOP_GPG_BINARY = None
 
+# concurrent calls to each external tool, by all the workers together
+SNOOP_BACKEND_CONCURRENCY = {
+    'tika': 8,
+    '7z': 2,
+    'readpst': 2,
+    'msgconvert': 4,
+    'gpg': 4,
+}
+
+SNOOP_REMEMBER_FAILURES = True # skip content a backend already failed on
+# backend versions, if they can't be detected; a failure recorded with
+# another version is retried
+SNOOP_BACKEND_VERSIONS = {}
+
 SNOOP_LOG_DIR = None
 
+SNOOP_JOB_LEASE = 300 # seconds
+SNOOP_QUEUE_SCHEDULE_REFRESH = 60 # seconds
+SNOOP_QUEUE_POLL_INTERVAL = 60 # seconds
+SNOOP_WORKER_STOP_TIMEOUT = 60 # seconds for jobs to finish when stopping
+SNOOP_QUEUE_RETRY = {
+    # a failed job waits `backoff` seconds, doubled after each attempt
+    'default': {'attempts': 3, 'backoff': 60},
+}
+SNOOP_SMALL_FILE_SIZE = 1024 * 1024 # 1M
+SNOOP_DIGEST_SPOOL_MEMORY = 16 * 1024 * 1024 # 16M, then it goes to disk
+
+SNOOP_WATCH_BATCH_DELAY = 2 # seconds
+SNOOP_WATCH_RESCAN_INTERVAL = 300 # seconds
+
 SNOOP_FEED_PAGE_SIZE = 100
@@ -2,6 +2,7 @@ import chardet
 from .html import text_from_html
 from .content_types import guess_filetype
 from . import models
+from .cache import cached, content_key
 
 def decode_bytes(content):
     try:
@@ -19,7 +20,8 @@ def decode_bytes(content):
         print("falling back to latin-1")
         return content.decode('latin-1')
 
-@models.cache(models.HtmlTextCache, lambda doc: doc.id)
+@cached('html_text', models.HtmlTextCache,
+    lambda doc: content_key(doc, guess_filetype(doc)))
 def get_text(doc):
     with doc.open() as f:
         content = f.read()
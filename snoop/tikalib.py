@@ -1,5 +1,9 @@
 from django.conf import settings
 from . import models
+from . import failures
+from . import exceptions
+from .cache import cached
+from .utils import backend_slot
 from dateutil import parser
 import os
 import hashlib
@@ -10,6 +14,8 @@ os.environ['TIKA_LOG_PATH'] = tempfile.mkdtemp(prefix="snoop_tika_")
 import tika
 import tika.parser
 import tika.language
+import requests
+from requests.exceptions import ReadTimeout
 
 tika.tika.TikaClientOnly = True
 tika.language.ServerEndpoint = settings.SNOOP_TIKA_SERVER_ENDPOINT
@@ -63,15 +69,45 @@ def extract_meta(meta):
     return data
 
 
-@models.cache(models.TikaCache, lambda sha1, open_file: sha1)
-def tika_parse(sha1, open_file):
-    with open_file() as f:
-        return tika.parser.from_buffer(f, settings.SNOOP_TIKA_SERVER_ENDPOINT)
+@failures.version_detector('tika')
+def tika_version():
+    url = settings.SNOOP_TIKA_SERVER_ENDPOINT.rstrip('/') + '/version'
+    return requests.get(url, timeout=10).text.strip()
+
+class TikaParseError(exceptions.BrokenDocument):
+    flag = 'tika_error'
+
+# statuses for content that tika can't parse; the others are the server's
+# problem, and it's worth trying again later
+BROKEN_STATUSES = {422, 500}
 
-@models.cache(models.TikaLangCache,
+def _put(url, data, **kwargs):
+    return requests.put(url, data, timeout=settings.SNOOP_TIKA_TIMEOUT,
+                        **kwargs)
+
+@cached('tika', models.TikaCache, lambda sha1, open_file: sha1)
+def tika_parse(sha1, open_file):
+    # a timeout means tika chokes on the content; it will time out again
+    remembered = failures.REMEMBERED + (ReadTimeout,)
+    with failures.remembered('tika', sha1, remembered), \
+            open_file() as f, backend_slot('tika'):
+        # like `tika.parser.from_buffer`, which hides the status and can't
+        # set a timeout
+        status, response = tika.tika.callServer(
+            'put', settings.SNOOP_TIKA_SERVER_ENDPOINT, '/rmeta/text', f,
+            {'Accept': 'application/json'}, False, httpVerbs={'put': _put},
+        )
+        if status in BROKEN_STATUSES:
+            raise TikaParseError("tika returned %d for %s" % (status, sha1))
+        if status != 200:
+            raise RuntimeError("tika returned %d for %s" % (status, sha1))
+        return tika.parser._parse((status, response))
+
+@cached('tika_lang', models.TikaLangCache,
     lambda text: hashlib.sha1(text.encode('utf-8')).hexdigest())
 def tika_lang(text):
-    lang = tika.language.from_buffer(text)
+    with backend_slot('tika'):
+        lang = tika.language.from_buffer(text)
     if 'error' in lang.lower():
         raise RuntimeError("Unexpected error in tika language: %s" % sha1)
     return lang
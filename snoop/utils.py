@@ -1,5 +1,7 @@
 import subprocess
 import re
+import random
+import zlib
 import exifread
 import json
 from datetime import datetime
@@ -7,6 +9,7 @@ from time import time
 from pathlib import Path
 from contextlib import contextmanager
 from django.conf import settings
+from django.db import connection
 
 def extract_gps_location(tags):
     def ratio_to_float(ratio):
@@ -79,10 +82,10 @@ def chunks(file, blocksize=65536):
 def pdftotext(input):
     return subprocess.check_output(['pdftotext', '-', '-'], stdin=input)
 
-def build_raw_query(table, where):
+def build_raw_query(table, where, fields=('id',)):
     """Build a raw SQL query with a user-defined `where` clause."""
     return " ".join([
-        'SELECT', 'id', 'FROM', table,
+        'SELECT', ', '.join(fields), 'FROM', table,
         'WHERE', where.replace('%', '%%'),
     ])
 
@@ -129,6 +132,45 @@ def timeit(name):
 
     return decorator
 
+def _backend_key(name):
+    """ The first key of the advisory locks for backend ``name``; the
+    second one is the slot. """
+    return zlib.crc32(('snoop backend ' + name).encode('utf8')) - 2 ** 31
+
+@contextmanager
+def backend_slot(name):
+    """ Wait for a free slot to call the external backend ``name``.
+
+    ``SNOOP_BACKEND_CONCURRENCY`` sets how many calls to each backend may
+    run at once, in all the worker processes and threads that share the
+    database. Each call holds a Postgres advisory lock on one of the
+    backend's slots; if a worker dies, its slots are freed along with its
+    connection. Backends without a limit are not throttled.
+    """
+    limit = settings.SNOOP_BACKEND_CONCURRENCY.get(name)
+    if not limit:
+        yield
+        return
+
+    key = _backend_key(name)
+    slots = list(range(limit))
+    random.shuffle(slots)
+    with connection.cursor() as cursor:
+        for slot in slots:
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", [key, slot])
+            if cursor.fetchone()[0]:
+                break
+        else:
+            # all of them are taken; wait for one
+            slot = slots[0]
+            cursor.execute("SELECT pg_advisory_lock(%s, %s)", [key, slot])
+
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s, %s)", [key, slot])
+
 def save_worker_metrics(timestamp, data):
     log_line = json.dumps(data) + '\n'
     day = datetime.utcfromtimestamp(timestamp).date().isoformat()
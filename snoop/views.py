@@ -106,7 +106,7 @@ def _process_document(collection_slug, id, data=None):
             'id': str(child_doc.id),
             'filename': str(child_doc.filename),
             'content_type': child_doc.content_type,
-        } for child_doc in doc.child_set.order_by('id')]
+        } for child_doc in doc.child_set.filter(deleted=False).order_by('id')]
 
         parent_id = doc.parent_id
 
@@ -181,15 +181,20 @@ def feed(request, collection_slug):
     page_size = settings.SNOOP_FEED_PAGE_SIZE
     page = list(query[:page_size])
 
-    def dump(digest, digested_at):
-        digest_data = json.loads(digest.data)
-        data = _process_document(collection_slug, digest.id, digest_data)
-        version = digested_at.isoformat().replace('+00:00', 'Z')
+    def dump(doc):
+        if doc.deleted:
+            data = {'id': str(doc.id), 'deleted': True}
+        else:
+            digest_data = json.loads(digest_objects[doc.id].data)
+            data = _process_document(collection_slug, doc.id, digest_data)
+        version = doc.digested_at.isoformat().replace('+00:00', 'Z')
         data['version'] = version
         return data
 
-    digest_objects = models.Digest.objects.in_bulk([doc.id for doc in page])
-    documents = [dump(digest_objects[doc.id], doc.digested_at) for doc in page]
+    digest_objects = models.Digest.objects.in_bulk(
+        [doc.id for doc in page if not doc.deleted]
+    )
+    documents = [dump(doc) for doc in page]
     rv = {'documents': documents}
     if documents:
         last_document = documents[-1]
@@ -1,10 +1,69 @@
+import hashlib
 import os
+import threading
 from pathlib import Path
+from time import time
 from . import models
+from . import pool
 from . import queues
+from django.db import connection
+from django.db.models import Q
 from .content_types import guess_content_type
+from .models import FOLDER
 
-FOLDER = 'application/x-directory'
+SAVE_MANIFEST_SQL = (
+    "INSERT INTO snoop_foldermanifest "
+    "(document_id, mtime, entries, fingerprint, time) "
+    "VALUES (%s, %s, %s, %s, now()) "
+    "ON CONFLICT (document_id) DO UPDATE SET "
+    "mtime = EXCLUDED.mtime, entries = EXCLUDED.entries, "
+    "fingerprint = EXCLUDED.fingerprint, time = EXCLUDED.time"
+)
+
+# mark documents, and everything below them, as deleted; their manifests go
+# away so the folders are synced again if they ever come back
+TOMBSTONE_SQL = (
+    "WITH RECURSIVE gone(id) AS ("
+    "  SELECT unnest(%(ids)s::int[])"
+    "  UNION SELECT d.id FROM snoop_document d JOIN gone ON d.parent_id = gone.id"
+    "), manifests AS ("
+    "  DELETE FROM snoop_foldermanifest"
+    "  WHERE document_id IN (SELECT id FROM gone)"
+    ") "
+    "UPDATE snoop_document SET deleted = true, digested_at = now() "
+    "WHERE id IN (SELECT id FROM gone) AND NOT deleted"
+)
+
+# seconds between saves of the walk cursor
+CURSOR_SAVE_INTERVAL = 10
+
+def _scan(folder):
+    """ List the entries of ``folder``, sorted by name. ``os.scandir`` gets
+    the entry types from the directory listing itself, and each entry
+    caches its ``stat()`` result, so we stat every file at most once. """
+    with os.scandir(str(folder)) as entries:
+        return sorted(entries, key=lambda entry: entry.name)
+
+def _fingerprint(folder, entries):
+    """ Describe the state of ``folder`` as ``(mtime, entries, hash)``;
+    the hash covers the name, size and mtime of each entry. """
+    hash = hashlib.sha1()
+    for entry in entries:
+        stat = entry.stat()
+        size = 0 if entry.is_dir() else stat.st_size
+        line = '%s\0%d\0%r\n' % (entry.name, size, stat.st_mtime)
+        hash.update(line.encode('utf8', 'surrogateescape'))
+    return (os.stat(str(folder)).st_mtime, len(entries), hash.hexdigest())
+
+def tombstone(ids):
+    """ Mark the documents with ``ids``, and their descendants, as deleted.
+    They show up in the feed as deleted. Returns the number of documents. """
+    with connection.cursor() as cursor:
+        cursor.execute(TOMBSTONE_SQL, {'ids': list(ids)})
+        return cursor.rowcount
+
+def _is_stale(doc, mtime):
+    return not doc.digested_at or doc.digested_at.timestamp() <= mtime
 
 class Walker(object):
 
@@ -14,93 +73,373 @@ class Walker(object):
         self.container_doc = container_doc
         self.documents = []
         self.collection = collection
+        self.manifests = None
+        self.folders = {}
+        self.resume_after = None
+        self.last_done = None
+        self.cursor_saved = time()
 
     def record_document(self, new_doc, created):
         if self.container_doc:
             self.documents.append((new_doc, created))
 
     @classmethod
-    def walk(cls, root, prefix, container_doc, collection):
+    def walk(cls, root, prefix, container_doc, collection, jobs=None,
+             resume=False):
         self = cls(root, prefix, container_doc, collection)
+        if resume:
+            self.load_cursor()
         try:
-            first_item = self.root / self.prefix if self.prefix else self.root
-            first_parent = self.container_doc
-            self.handle(first_item, first_parent)
+            if jobs and jobs > 1:
+                self.run_threaded(jobs)
+            else:
+                self.run()
         except KeyboardInterrupt:
             pass
         return self.documents
 
+    def run(self):
+        """ Walk depth-first, in name order. That order is the same every
+        time, so for collection walks we save the last synced folder as a
+        cursor, and an interrupted walk can be resumed from it. """
+        pending = [self.start()]
+        try:
+            while pending:
+                folder, doc = pending.pop()
+                pending.extend(reversed(self.handle_folder(folder, doc)))
+                self.checkpoint(folder)
+
+        except BaseException:
+            self.save_cursor()
+            raise
+
+        self.clear_cursor()
+
+    def _cursor(self):
+        if self.container_doc:
+            return None
+        return models.WalkCursor.objects.filter(
+            collection=self.collection,
+            prefix=str(self.prefix or ''),
+        )
+
+    def load_cursor(self):
+        cursor = self._cursor()
+        if cursor is None:
+            return
+        path = cursor.values_list('path', flat=True).first()
+        if path is not None:
+            print("RESUME AFTER ", path)
+            self.resume_after = Path(path).parts
+
+    def checkpoint(self, folder):
+        self.last_done = self._path(folder)
+        if time() - self.cursor_saved >= CURSOR_SAVE_INTERVAL:
+            self.save_cursor()
+
+    def save_cursor(self):
+        if self._cursor() is None or self.last_done is None:
+            return
+        models.WalkCursor.objects.update_or_create(
+            collection=self.collection,
+            prefix=str(self.prefix or ''),
+            defaults={'path': str(self.last_done)},
+        )
+        self.cursor_saved = time()
+
+    def clear_cursor(self):
+        cursor = self._cursor()
+        if cursor is not None:
+            cursor.delete()
+
+    def run_threaded(self, jobs):
+        """ Walk with ``jobs`` threads, each handling one folder at a time.
+
+        A folder's subfolders are only handed out after its own entries are
+        saved, so their parent documents always exist, and each folder is
+        handled by a single thread, so no document is created twice.
+        Threads spend most of their time waiting for the filesystem or the
+        database, which happens outside of the GIL.
+
+        Folders finish in no particular order, so there is no cursor to
+        save; an older one, left by a serial walk, would make the next
+        ``--resume`` skip folders, so we drop it.
+        """
+        self.clear_cursor()
+        pending = [self.start()]
+        busy = 0
+        stopping = False
+        lock = threading.Condition()
+
+        def run():
+            nonlocal busy, stopping
+            while True:
+                with lock:
+                    while not (pending or stopping) and busy:
+                        lock.wait()
+                    if stopping or not pending:
+                        return
+                    folder, doc = pending.pop()
+                    busy += 1
+
+                try:
+                    subfolders = self.handle_folder(folder, doc)
+                except Exception:
+                    with lock:
+                        stopping = True
+                        busy -= 1
+                        lock.notify_all()
+                    raise
+
+                with lock:
+                    pending.extend(reversed(subfolders))
+                    busy -= 1
+                    lock.notify_all()
+
+        try:
+            pool.threaded(run, jobs)
+        except KeyboardInterrupt:
+            with lock:
+                stopping = True
+                lock.notify_all()
+            raise
+
     def _path(self, file):
         return file.relative_to(self.root)
 
-    def handle(self, item, parent):
-        print("WALK ENTER   ", str(self._path(item)))
-        if item.is_dir():
-            self.handle_folder(item, parent)
-        else:
-            self.handle_file(item, parent)
-        print("WALK EXIT    ", str(self._path(item)))
-
-    def handle_folder(self, folder, parent):
-        path = self._path(folder)
-        print("HANDLE FOLDER", str(path))
-        if str(path) == '.':
-            if self.container_doc:
-                new_doc = self.container_doc
-                created = True
-            else:
-                new_doc, created = models.Document.objects.get_or_create(
-                    path='',
-                    disk_size=0,
-                    content_type=FOLDER,
-                    filename='',
-                    collection=self.collection,
-                )
+    def start(self):
+        """ Find the document of the walk's first folder, creating it if
+        needed. Returns a ``(folder, doc)`` tuple. """
+        if self.container_doc:
+            root_doc = self.container_doc
         else:
-            new_doc, created = models.Document.objects.get_or_create(
-                path=path,
+            root_doc, _ = models.Document.objects.get_or_create(
+                path='',
                 disk_size=0,
                 content_type=FOLDER,
-                filename=path.name,
-                parent=parent,
-                container=self.container_doc,
+                filename='',
                 collection=self.collection,
             )
-            self.record_document(new_doc, created)
-
-        folder_mtime = os.path.getmtime(str(folder.resolve()))
-        if created or \
-                not new_doc.digested_at or \
-                new_doc.digested_at.timestamp() <= folder_mtime:
-            if new_doc.path:  # avoid digesting / indexing the root
-                queues.put('digest', {'id': new_doc.id})
-
-        for child in folder.iterdir():
-            self.handle(child, new_doc)
-
-    def handle_file(self, file, parent):
-        path = self._path(file)
-        print("HANDLE FILE  ", str(path))
-        new_doc, created = models.Document.objects.get_or_create(
-            path=path,
-            parent=parent,
-            container=self.container_doc,
+            self.load_manifests()
+
+        if not self.prefix:
+            return (self.root, root_doc)
+
+        # walk the prefix's path down from the root, one folder at a time
+        folder = self.root
+        doc = root_doc
+        for name in self.prefix.parts:
+            parent = folder
+            folder = folder / name
+            entries = [e for e in _scan(parent) if e.name == name]
+            if not entries:
+                raise RuntimeError("Path not found: %s" % folder)
+            # the listing is partial; the rest of the folder is not ours
+            if not entries[0].is_dir():
+                self.sync(parent, doc, entries, complete=False)
+                return (parent, None)
+            [(doc, _)] = self.sync(parent, doc, entries, complete=False)
+        return (folder, doc)
+
+    def load_manifests(self):
+        """ Load the collection's folder documents and their manifests, so
+        that unchanged folders can be walked without any queries. Only done
+        for collection walks; container walks must report every child.
+        With a prefix, only the folders below it are loaded; the watcher
+        walks each new folder that way, and it would be a waste to load
+        the whole collection every time. """
+        folders = models.Document.objects.filter(
             collection=self.collection,
-            defaults={
-                'disk_size': file.stat().st_size,
-                'content_type': guess_content_type(file.name),
-                'filename': path.name,
-            },
+            container__isnull=True,
+            content_type=FOLDER,
         )
-        self.record_document(new_doc, created)
-        file_mtime = os.path.getmtime(str(file.resolve()))
-        if created or \
-                not new_doc.digested_at or \
-                new_doc.digested_at.timestamp() <= file_mtime:
-            queues.put('digest', {'id': new_doc.id})
+        if self.prefix:
+            prefix = str(self.prefix)
+            folders = folders.filter(
+                Q(path=prefix) | Q(path__startswith=prefix + '/')
+            )
+        self.folders = {doc.path: doc for doc in folders}
+        self.manifests = {
+            manifest.document_id: manifest.as_tuple()
+            for manifest in models.FolderManifest.objects.filter(
+                document__in=folders,
+            )
+        }
+
+    def unchanged(self, folder, entries):
+        """ If ``folder`` looks the same as when we last synced it, return
+        its subfolders' ``(folder, doc)`` tuples; otherwise ``None``. """
+        path = self._path(folder)
+        subfolders = []
+        for entry in entries:
+            if entry.is_dir():
+                doc = self.folders.get(str(path / entry.name))
+                if doc is None:
+                    return None
+                subfolders.append((folder / entry.name, doc))
+        return subfolders
+
+    def skip_done(self, folder, doc, entries):
+        """ ``folder`` was synced before the walk was interrupted. Return
+        the subfolders that may still have work in them: the ones on the
+        way to the cursor, and the ones after it. """
+        path = self._path(folder)
+        wanted = []
+        children = {}
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            child_path = path / entry.name
+            parts = child_path.parts
+            if parts < self.resume_after and \
+                    parts != self.resume_after[:len(parts)]:
+                continue
+            child = self.folders.get(str(child_path))
+            if child is None:
+                child = models.Document.objects.filter(
+                    parent=doc,
+                    path=str(child_path),
+                ).first()
+            wanted.append(entry.name)
+            children[entry.name] = child
+
+        if any(child is None or child.deleted for child in children.values()):
+            # a subfolder appeared, or came back, after we synced this one
+            print("WALK FOLDER  ", str(path))
+            docs = self.sync(folder, doc, entries)
+            children = {
+                entry.name: child
+                for entry, (child, _) in zip(entries, docs)
+            }
+
+        return [(folder / name, children[name]) for name in wanted]
+
+    def handle_folder(self, folder, doc):
+        """ Sync the documents of ``folder``'s entries. Returns the
+        ``(subfolder, doc)`` tuples that should be walked next.
+
+        If the folder's fingerprint matches its manifest from the previous
+        walk, nothing in it was added, removed or modified, so we skip the
+        database altogether. We still walk its subfolders though: changes
+        deeper in the tree don't show up in the folder's own fingerprint.
+        """
+        if doc is None:
+            return []
+        entries = _scan(folder)
+
+        if self.resume_after is not None:
+            parts = self._path(folder).parts
+            if parts <= self.resume_after:
+                return self.skip_done(folder, doc, entries)
+
+        fingerprint = None
+        if self.manifests is not None:
+            fingerprint = _fingerprint(folder, entries)
+            if self.manifests.get(doc.id) == fingerprint:
+                subfolders = self.unchanged(folder, entries)
+                if subfolders is not None:
+                    return subfolders
+
+        print("WALK FOLDER  ", str(self._path(folder)))
+        docs = self.sync(folder, doc, entries)
+        if fingerprint:
+            with connection.cursor() as cursor:
+                cursor.execute(SAVE_MANIFEST_SQL, [doc.id] + list(fingerprint))
+
+        return [
+            (folder / entry.name, child)
+            for entry, (child, _) in zip(entries, docs)
+            if entry.is_dir()
+        ]
+
+    def sync(self, folder, parent, entries, complete=True):
+        """ Make sure there's a document for each of ``entries`` (found in
+        ``folder``, whose document is ``parent``), and queue the new and
+        modified ones for digest. Uses one query to load the existing
+        documents, one to create the missing ones and one to queue them.
+        If ``entries`` is the ``complete`` listing of the folder, documents
+        that are no longer on disk are marked as deleted; they come back to
+        life if they reappear. Returns a ``(doc, created)`` tuple for each
+        entry. """
+        path = self._path(folder)
+        existing = {
+            doc.path: doc for doc in
+            models.Document.objects.filter(
+                parent=parent,
+                container=self.container_doc,
+                collection=self.collection,
+            )
+        }
+
+        result = []
+        new_docs = []
+        seen = set()
+        for entry in entries:
+            child_path = str(path / entry.name)
+            seen.add(child_path)
+            doc = existing.get(child_path)
+            created = doc is None
+            if doc is not None and doc.deleted:
+                self.revive(doc, entry)
+                created = True
+            elif created:
+                is_dir = entry.is_dir()
+                doc = models.Document(
+                    path=child_path,
+                    disk_size=0 if is_dir else entry.stat().st_size,
+                    content_type=FOLDER if is_dir
+                        else guess_content_type(entry.name),
+                    filename=entry.name,
+                    parent=parent,
+                    container=self.container_doc,
+                    collection=self.collection,
+                )
+                new_docs.append(doc)
+            result.append((doc, created))
+
+        if new_docs:
+            # postgres returns the primary keys of the new rows
+            models.Document.objects.bulk_create(new_docs)
+
+        # a set-difference pass to find what disappeared from the folder
+        gone = [
+            doc.id for child_path, doc in existing.items()
+            if complete and child_path not in seen and not doc.deleted
+        ]
+        if gone:
+            print("DELETED      ", tombstone(gone), "in", str(path))
+
+        to_digest = []
+        for entry, (doc, created) in zip(entries, result):
+            self.record_document(doc, created)
+            if created:
+                to_digest.append(doc)
+            elif _is_stale(doc, entry.stat().st_mtime):
+                if not entry.is_dir():
+                    self.modified(doc, entry)
+                to_digest.append(doc)
+
+        queues.put_documents(to_digest)
+        return result
+
+    def revive(self, doc, entry):
+        """ A deleted document is back on disk. Its content may have changed
+        in the meantime, so we forget the hashes and digest it again. """
+        doc.deleted = False
+        doc.md5 = doc.sha1 = ''
+        if not entry.is_dir():
+            doc.disk_size = entry.stat().st_size
+        doc.save(update_fields=['deleted', 'md5', 'sha1', 'disk_size'])
+
+    def modified(self, doc, entry):
+        """ A file was changed on disk since it was digested. We forget
+        its hashes, so that the digest doesn't reuse the old content. """
+        doc.md5 = doc.sha1 = ''
+        doc.disk_size = entry.stat().st_size
+        doc.save(update_fields=['md5', 'sha1', 'disk_size'])
 
 def files_in(doc):
-    child_documents = models.Document.objects.filter(parent=doc)
+    child_documents = models.Document.objects.filter(parent=doc, deleted=False)
     return [{
         'id': child.id,
         'filename': child.filename,
@@ -0,0 +1,251 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+from pathlib import Path
+from time import time, sleep
+from django.conf import settings
+from . import models
+from .models import FOLDER
+from .walker import Walker
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# we don't care about IN_MODIFY; a file is done when it's closed
+WATCH_MASK = (
+    IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+    IN_CREATE | IN_DELETE | IN_ONLYDIR
+)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+class Inotify(object):
+    """ A minimal binding to the Linux inotify API. Raises ``OSError`` if
+    inotify is not available. """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError(errno.ENOSYS, "inotify is not supported")
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            self._error()
+
+    def _error(self):
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(str(path)), mask)
+        if wd < 0:
+            self._error()
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout=None):
+        """ Wait up to ``timeout`` seconds for events, and return them as
+        ``(wd, mask, name)`` tuples. """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        events = []
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+                offset += EVENT_HEADER.size
+                name = buffer[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+class Watcher(object):
+    """ Keep a collection's documents in sync with changes on disk, as they
+    happen. Each folder gets an inotify watch; changes are gathered into
+    batches, and the folders they happened in are synced by the walker.
+
+    The number of watches is limited by ``fs.inotify.max_user_watches``.
+    When it runs out, or inotify isn't available, we walk the collection
+    every ``SNOOP_WATCH_RESCAN_INTERVAL`` seconds instead; the folder
+    manifests make that cheap enough.
+    """
+
+    def __init__(self, collection, prefix=None):
+        self.collection = collection
+        self.prefix = prefix
+        self.root = Path(collection.path)
+        self.top = self.root / prefix if prefix else self.root
+        self.inotify = None
+        self.watches = {}
+        self.rescan_needed = False
+
+    def start(self):
+        """ Watch all the folders. Call this before the initial walk, so
+        that no change falls in between. Returns ``False`` if we have to
+        fall back to periodic rescans. """
+        try:
+            self.inotify = Inotify()
+            self.add_tree(self.top)
+        except OSError as e:
+            self.stop_watching(e)
+            return False
+        return True
+
+    def stop_watching(self, error):
+        print("Can't watch for changes:", error)
+        if error.errno == errno.ENOSPC:
+            print("Raise the fs.inotify.max_user_watches sysctl to fix this.")
+        print("Rescanning every", settings.SNOOP_WATCH_RESCAN_INTERVAL,
+              "seconds instead.")
+        if self.inotify:
+            self.inotify.close()
+        self.inotify = None
+        self.watches = {}
+
+    def add_tree(self, folder):
+        for dirpath, _, _ in os.walk(str(folder)):
+            try:
+                wd = self.inotify.add_watch(dirpath)
+            except FileNotFoundError:
+                continue  # deleted while we were walking
+            self.watches[wd] = Path(dirpath)
+
+    def drop_tree(self, folder):
+        for wd, path in list(self.watches.items()):
+            if path == folder or folder in path.parents:
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def poll(self, timeout=None):
+        """ Wait for changes, then sync the folders where they happened.
+        Returns the number of synced folders. """
+        events = self.inotify.read(timeout)
+        if not events:
+            return 0
+
+        # files tend to change in bursts; gather them into one batch
+        deadline = time() + settings.SNOOP_WATCH_BATCH_DELAY
+        while time() < deadline:
+            more = self.inotify.read(deadline - time())
+            if not more:
+                break
+            events.extend(more)
+
+        changed = set()
+        new_trees = set()
+        for wd, mask, name in events:
+            if mask & IN_Q_OVERFLOW:
+                self.rescan_needed = True
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            folder = self.watches.get(wd)
+            if folder is None:
+                continue
+
+            changed.add(folder)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.add_tree(folder / name)
+                    new_trees.add(folder / name)
+                if mask & IN_MOVED_FROM:
+                    self.drop_tree(folder / name)
+
+        return self.sync(changed, new_trees)
+
+    def _folder_doc(self, walker, folder):
+        path = walker._path(folder)
+        return models.Document.objects.filter(
+            collection=self.collection,
+            container__isnull=True,
+            content_type=FOLDER,
+            deleted=False,
+            path='' if str(path) == '.' else str(path),
+        ).first()
+
+    def sync(self, changed, new_trees):
+        """ Sync the ``changed`` folders, and everything in ``new_trees``.
+        Parents go first, so the documents of new folders exist by the
+        time we get to them. """
+        walker = Walker(self.root, None, None, self.collection)
+        # no manifest will match, but the walker keeps them up to date
+        walker.manifests = {}
+        count = 0
+        for folder in sorted(changed | new_trees, key=lambda f: len(f.parts)):
+            if not folder.is_dir():
+                continue  # its parent's sync marks it as deleted
+            doc = self._folder_doc(walker, folder)
+            if doc is None:
+                Walker.walk(self.root, str(walker._path(folder)), None,
+                            self.collection)
+                continue
+
+            pending = [(folder, doc)]
+            while pending:
+                subfolders = walker.handle_folder(*pending.pop())
+                count += 1
+                if folder in new_trees:
+                    pending.extend(subfolders)
+
+        return count
+
+    def rescan(self):
+        Walker.walk(
+            root=self.collection.path,
+            prefix=self.prefix,
+            container_doc=None,
+            collection=self.collection,
+        )
+
+    def run(self):
+        try:
+            while True:
+                if self.inotify is None:
+                    sleep(settings.SNOOP_WATCH_RESCAN_INTERVAL)
+                    self.rescan()
+                    continue
+
+                if self.rescan_needed:
+                    self.rescan_needed = False
+                    self.rescan()
+
+                try:
+                    self.poll()
+                except OSError as e:
+                    if e.errno != errno.ENOSPC:
+                        raise
+                    self.stop_watching(e)
+                    self.rescan()
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            if self.inotify:
+                self.inotify.close()
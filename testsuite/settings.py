@@ -6,5 +6,6 @@ SNOOP_ANALYZE_LANG = False
 SNOOP_TIKA_FILE_TYPES = []
 SNOOP_TIKA_SERVER_ENDPOINT = None
 SNOOP_FEED_PAGE_SIZE = 10
+SNOOP_BACKEND_CONCURRENCY = {}
 
 from snoop.site.settings.testing_local import *
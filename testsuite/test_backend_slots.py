@@ -0,0 +1,42 @@
+import threading
+from time import sleep
+import pytest
+from django.conf import settings
+from django.db import connection
+from snoop import pool
+from snoop.utils import backend_slot
+
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set"),
+]
+
+def test_backend_slots_limit_concurrent_calls(settings):
+    settings.SNOOP_BACKEND_CONCURRENCY = {'slow': 2}
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def target():
+        # each thread has its own connection, like separate processes
+        with backend_slot('slow'):
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            sleep(0.05)
+            with lock:
+                running.pop()
+
+    pool.threaded(target, 6)
+    assert max(peak) == 2
+    assert len(peak) == 6
+
+def test_backend_slots_are_freed(settings):
+    settings.SNOOP_BACKEND_CONCURRENCY = {'slow': 1}
+    with pytest.raises(RuntimeError):
+        with backend_slot('slow'):
+            raise RuntimeError
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_locks "
+                       "WHERE locktype = 'advisory' AND granted")
+        assert cursor.fetchone()[0] == 0
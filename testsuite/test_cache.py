@@ -0,0 +1,144 @@
+import os
+from datetime import timedelta
+from time import time
+import pytest
+from django.conf import settings
+from django.utils import timezone
+from snoop import models, emails
+from snoop.cache import cached, content_key, caches, MemoryTier, MISS
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set"),
+]
+
+@pytest.fixture
+def tiered(settings, tmpdir):
+    settings.SNOOP_CACHE = True
+    settings.SNOOP_CACHE_DISK_ROOT = str(tmpdir)
+    calls = []
+
+    @cached('test', models.TikaCache, lambda sha1: sha1)
+    def compute(sha1):
+        calls.append(sha1)
+        return {'value': sha1.upper()}
+
+    yield compute, calls
+    del caches['test']
+
+def test_each_tier_is_hit_in_turn(tiered, tmpdir):
+    compute, calls = tiered
+    cache = compute.cache
+
+    assert compute('abc') == {'value': 'ABC'}
+    assert compute('abc') == {'value': 'ABC'}
+    assert cache.stats == {'miss': 1, 'memory_hit': 1}
+
+    cache.tiers[0].clear()
+    assert compute('abc') == {'value': 'ABC'}
+    assert cache.stats['disk_hit'] == 1
+
+    cache.tiers[0].clear()
+    tmpdir.remove()
+    assert compute('abc') == {'value': 'ABC'}
+    assert cache.stats['db_hit'] == 1
+    assert calls == ['abc']
+    assert models.TikaCache.objects.get(sha1='abc').value == '{"value": "ABC"}'
+
+def test_memory_tier_evicts_least_recently_used():
+    # each value is 10 bytes of JSON
+    tier = MemoryTier(80)
+    for n in range(8):
+        tier.set(n, 'x' * 8)
+    tier.get(0)
+    tier.set(8, 'x' * 8)
+    assert list(tier.values) == [2, 3, 4, 5, 6, 7, 0, 8]
+    assert tier.used == 80
+
+def test_memory_tier_skips_big_values(settings):
+    tier = MemoryTier(800)
+    tier.set('small', 'x' * 10)
+    tier.set('big', 'x' * 100)
+    assert tier.get('big') is MISS
+    assert tier.get('small') == 'x' * 10
+    assert tier.used == 12
+
+def test_gc_evicts_cold_entries(tiered):
+    compute, _ = tiered
+    for key in ['cold', 'warm', 'hot']:
+        compute(key)
+    now = timezone.now()
+    for days, key in enumerate(['hot', 'warm', 'cold']):
+        models.TikaCache.objects.filter(sha1=key).update(
+            time=now - timedelta(days=days * 10))
+        path = str(compute.cache.tiers[1].path(key))
+        os.utime(path, (time() - days * 10 * 86400,) * 2)
+
+    for tier in compute.cache.tiers[1:]:
+        evicted = tier.gc(max_age=15, dry_run=True)
+        assert tier.usage()['entries'] == 3
+        assert tier.gc(max_age=15) == evicted
+        assert tier.usage()['entries'] == 2
+        one_entry = tier.usage()['bytes'] / 2
+        assert tier.gc(max_size=one_entry)[0] == 1
+        assert tier.usage()['entries'] == 1
+
+    assert list(models.TikaCache.objects.values_list('sha1', flat=True)) \
+        == ['hot']
+    compute.cache.tiers[0].clear()
+    compute('hot')
+    assert compute.cache.stats['disk_hit'] == 1
+
+def test_db_hits_touch_old_entries(tiered):
+    compute, _ = tiered
+    compute('abc')
+    old = timezone.now() - timedelta(days=2)
+    models.TikaCache.objects.update(time=old)
+    assert compute.cache.tiers[2].get('abc') == {'value': 'ABC'}
+    assert models.TikaCache.objects.get().time > old
+
+def test_prefetch_fills_memory(tiered):
+    compute, calls = tiered
+    for key in ['a', 'b']:
+        compute(key)
+    compute.cache.tiers[0].clear()
+    compute.cache.reset_stats()
+
+    compute.cache.prefetch(['a', 'b', 'c'])
+    assert sorted(compute.cache.tiers[0].values) == ['a', 'b']
+    compute('a')
+    compute('b')
+    assert compute.cache.stats == {'miss': 0, 'memory_hit': 2}
+
+def test_content_key():
+    doc = models.Document(sha1='f' * 40)
+    assert content_key(doc, 'html') == 'f' * 40 + ':html'
+    assert content_key(models.Document(), 'html') is None
+
+def test_email_cache_hit_keeps_pgp_flag(settings, tmpdir, monkeypatch):
+    settings.SNOOP_CACHE = True
+    settings.SNOOP_CACHE_DISK_ROOT = str(tmpdir)
+
+    class Encrypted:
+        pgp = True
+        def get_tree(self):
+            return {'headers': {}}
+        def get_attachments(self):
+            return {}
+        def get_text(self):
+            return ''
+
+    opened = []
+    def open_email(doc):
+        opened.append(doc.path)
+        doc.flags['pgp'] = True
+        return Encrypted()
+    monkeypatch.setattr(emails, 'open_email', open_email)
+
+    for path in ['a.eml', 'b.eml']:
+        doc = models.Document(path=path, sha1='e' * 40,
+                              content_type='message/rfc822')
+        doc.save = lambda: None
+        emails.parse_email(doc)
+        assert doc.flags == {'pgp': True}
+    assert opened == ['a.eml']
@@ -0,0 +1,59 @@
+import json
+import pytest
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_init
+from snoop import models
+from snoop.cache import DatabaseTier
+from snoop.compression import encode, decode, is_compressed
+from snoop.management.commands.compressdata import reencode
+
+TREE = json.dumps({
+    'headers': {'Subject': ['Hello'], 'Content-Type': ['multipart/mixed']},
+    'parts': [{'headers': {'Content-Type': ['text/plain']}}] * 20,
+})
+
+def test_encode_round_trip():
+    assert encode('short') == b'short'
+    encoded = encode(TREE)
+    assert is_compressed(encoded)
+    assert len(encoded) < len(TREE) / 5
+    assert decode(encoded) == TREE
+    assert decode('plain ünicode'.encode('utf8')) == 'plain ünicode'
+
+@pytest.mark.django_db
+@pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set")
+def test_reencode_plain_rows():
+    models.Digest.objects.create(id=1, data=TREE)
+    with connection.cursor() as cursor:
+        # the way rows look right after the migration
+        cursor.execute(
+            "INSERT INTO snoop_digest (id, data_plain) VALUES (2, %s)",
+            [TREE])
+    assert models.Digest.objects.get(id=2).data == TREE
+
+    field = models.Digest._meta.get_field('data')
+    plain = models.Digest._meta.get_field('data_plain')
+    count, saved = reencode(models.Digest, field, plain, batch=1)
+    assert count == 1 and saved > 0
+    assert reencode(models.Digest, field, plain, batch=1) == (0, 0)
+    for digest in models.Digest.objects.all():
+        assert digest.data == TREE
+        assert digest.data_plain is None
+
+@pytest.mark.django_db
+@pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set")
+def test_cache_reads_plain_rows():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO snoop_tikacache (sha1, value_plain, time) "
+            "VALUES ('a', %s, now())", [TREE])
+    tier = DatabaseTier(models.TikaCache)
+    assert tier.get('a') == json.loads(TREE)
+    assert tier.get_many(['a', 'b']) == {'a': json.loads(TREE)}
+
+def test_only_compressed_models_read_plain_columns():
+    assert post_init.has_listeners(models.Digest)
+    assert post_init.has_listeners(models.TikaCache)
+    assert not post_init.has_listeners(models.Document)
+    assert not post_init.has_listeners(models.Job)
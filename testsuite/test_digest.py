@@ -1,7 +1,10 @@
 # encoding: utf-8
 
+from io import BytesIO
 import pytest
-from snoop import digest, models
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from snoop import cache, digest, models, queues
 from snoop.content_types import guess_content_type
 from snoop import pst, archives
 
@@ -93,3 +96,185 @@ def test_digest_image_exif(document_collection):
 def test_digest_magic_file_types(document_collection, path, expected_type):
     data = digest_path(path, document_collection)
     assert data['type'] == expected_type
+
+def test_contained_document_is_read_once(document_collection, monkeypatch):
+    opened = []
+    def open_file(doc):
+        opened.append(doc.path)
+        return BytesIO(b'hello world')
+    monkeypatch.setattr(models.Document, '_open_file', open_file)
+
+    container = models.Document(
+        id=1,
+        path='message.eml',
+        content_type='message/rfc822',
+        collection=document_collection,
+    )
+    doc = models.Document(
+        path='hello',
+        filename='hello',
+        content_type='text/plain',
+        collection=document_collection,
+        container=container,
+    )
+    doc.save = lambda: None
+    data = digest.digest(doc)
+
+    assert opened == ['hello']
+    assert data['type'] == 'text'
+    assert data['text'] == 'hello world'
+    assert data['md5'] == '5eb63bbbe01eeed093cb22bb8f5acdc3'
+    assert doc.spool is None
+
+    # archive members are opened from the extracted files
+    container.content_type = 'application/zip'
+    assert digest._new_spool(doc) is None
+
+@pytest.mark.django_db
+def test_duplicates_reuse_content_digest(monkeypatch, tmpdir, settings):
+    settings.SNOOP_CACHE = True
+    tmpdir.join('one.txt').write('same text')
+    tmpdir.join('two.txt').write('same text')
+    collection = models.Collection.objects.create(slug='dup', path=str(tmpdir))
+    one, two = [
+        models.Document.objects.create(
+            path=name,
+            filename=name,
+            content_type='text/plain',
+            disk_size=9,
+            collection=collection,
+        ) for name in ['one.txt', 'two.txt']
+    ]
+    digest.digest(one)
+
+    def no_guessing(doc):
+        raise AssertionError("should reuse the content digest")
+    monkeypatch.setattr(digest, 'guess_filetype', no_guessing)
+    data = digest.digest(two)
+
+    assert data['path'] == data['filename'] == 'two.txt'
+    assert data['text'] == 'same text'
+    assert data['sha1'] == one.sha1
+    assert models.ContentDigest.objects.count() == 1
+
+@pytest.mark.django_db
+def test_stored_content_is_versioned(tmpdir, settings):
+    settings.SNOOP_CACHE = True
+    tmpdir.join('one.txt').write('some text')
+    collection = models.Collection.objects.create(slug='v', path=str(tmpdir))
+    doc = models.Document.objects.create(
+        path='one.txt',
+        filename='one.txt',
+        content_type='text/plain',
+        disk_size=9,
+        collection=collection,
+    )
+    digest.digest(doc)
+    models.ContentDigest.objects.update(data='{"text": "stale"}')
+    assert digest.digest(doc)['text'] == 'stale'
+    assert digest.digest(doc, refresh=True)['text'] == 'some text'
+    assert digest.digest(doc)['text'] == 'some text'
+
+    settings.SNOOP_ANALYZE_LANG = not settings.SNOOP_ANALYZE_LANG
+    assert digest._stored_content(doc) is None
+    settings.SNOOP_CACHE = False
+    settings.SNOOP_ANALYZE_LANG = not settings.SNOOP_ANALYZE_LANG
+    assert digest._stored_content(doc) is None
+
+    assert cache.tables['content'].usage()['entries'] == 1
+    assert cache.tables['members'].usage()['entries'] == 0
+
+@pytest.mark.django_db
+def test_overlapping_collection_digests_without_reading(monkeypatch,
+                                                        settings):
+    settings.SNOOP_CACHE = True
+    opened = []
+    def open_file(doc):
+        opened.append(doc.collection.slug)
+        return BytesIO(b'attached text')
+    monkeypatch.setattr(models.Document, '_open_file', open_file)
+
+    results = []
+    for slug in ['first', 'second']:
+        collection = models.Collection.objects.create(slug=slug, path='/')
+        container = models.Document.objects.create(
+            path='box.zip',
+            filename='box.zip',
+            content_type='application/zip',
+            disk_size=100,
+            sha1='f' * 40,
+            collection=collection,
+        )
+        child = models.Document.objects.create(
+            path='note.txt',
+            filename='note.txt',
+            content_type='text/plain',
+            disk_size=0,
+            container=container,
+            parent=container,
+            collection=collection,
+        )
+        results.append(digest.digest(child))
+
+    # archive members are opened from the extracted files, without a spool
+    assert set(opened) == {'first'}
+    first, second = results
+    assert second['text'] == first['text'] == 'attached text'
+    assert second['md5'] == first['md5']
+    assert second['message'] != first['message']
+
+def _text_documents(tmpdir, texts):
+    collection = models.Collection.objects.create(slug='batch',
+                                                  path=str(tmpdir))
+    for n, text in enumerate(texts):
+        name = '%d.txt' % n
+        tmpdir.join(name).write(text)
+        models.Document.objects.create(
+            path=name,
+            filename=name,
+            content_type='text/plain',
+            disk_size=len(text),
+            collection=collection,
+        )
+    return collection.document_set.order_by('id')
+
+def _digest_batch(docs):
+    queues.put_documents(docs)
+    jobs = queues.iterate('digest', batch=10, on_claim=digest.prefetch)
+    for work in jobs:
+        with work() as data:
+            digest.worker(verbose=False, **data)
+
+@pytest.mark.django_db
+def test_prefetch_batch_lookups(tmpdir, settings, monkeypatch):
+    monkeypatch.undo()  # look up OCR text for real
+    settings.SNOOP_CACHE = True
+    docs = _text_documents(tmpdir, ['one', 'two', 'three'])
+    _digest_batch(docs)
+    before = dict(models.Digest.objects.values_list('id', 'data'))
+
+    with CaptureQueriesContext(connection) as queries:
+        _digest_batch(docs)
+
+    # queueing, claiming and prefetching take 12 queries for the batch;
+    # then each document is loaded, its digest loaded and saved, the
+    # document saved and the job deleted. Lookups go through the prefetch.
+    assert len(queries) == 12 + 5 * len(docs)
+    assert dict(models.Digest.objects.values_list('id', 'data')) == before
+
+@pytest.mark.django_db
+def test_prefetch_reuses_content_within_batch(tmpdir, settings, monkeypatch):
+    docs = _text_documents(tmpdir, ['a', 'bb', 'a', 'bb'])
+    _digest_batch(docs)
+
+    settings.SNOOP_CACHE = True
+    digested = []
+    digest_content = digest._digest_content
+    def counting(doc):
+        digested.append(doc.sha1)
+        return digest_content(doc)
+    monkeypatch.setattr(digest, '_digest_content', counting)
+    _digest_batch(docs)
+
+    assert len(digested) == len(set(digested)) == 2
+    assert not hasattr(digest._prefetched, 'contents')
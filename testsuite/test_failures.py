@@ -0,0 +1,111 @@
+import subprocess
+from io import BytesIO
+import pytest
+from requests.exceptions import ReadTimeout
+from django.conf import settings
+from django.core.management import call_command
+from snoop import models, failures, tikalib
+from snoop.archives import ExtractingFailed
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set"),
+]
+
+SHA1 = 'f' * 40
+
+def _call(backend, error, calls):
+    with failures.remembered(backend, SHA1):
+        calls.append(backend)
+        if error:
+            raise error
+
+def test_failures_are_skipped_until_the_version_changes(settings):
+    settings.SNOOP_BACKEND_VERSIONS = {'7z': '16.02'}
+    calls = []
+    with pytest.raises(ExtractingFailed):
+        _call('7z', ExtractingFailed("corrupt"), calls)
+
+    with pytest.raises(failures.KnownFailure) as e:
+        _call('7z', None, calls)
+    assert e.value.flag == 'archive_extraction_failed'
+    assert calls == ['7z']
+
+    settings.SNOOP_BACKEND_VERSIONS = {'7z': '16.03'}
+    _call('7z', None, calls)
+    assert calls == ['7z', '7z']
+
+def test_only_repeatable_errors_are_remembered(settings):
+    settings.SNOOP_BACKEND_VERSIONS = {'msgconvert': ''}
+    calls = []
+    with pytest.raises(ConnectionError):
+        _call('msgconvert', ConnectionError(), calls)
+    assert not models.ExtractionFailure.objects.exists()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        _call('msgconvert', subprocess.CalledProcessError(1, 'x'), calls)
+    failure = models.ExtractionFailure.objects.get()
+    assert (failure.backend, failure.error) == \
+        ('msgconvert', 'CalledProcessError')
+    with pytest.raises(failures.KnownFailure) as e:
+        _call('msgconvert', None, calls)
+    assert e.value.flag == 'msgconvert_failed'
+
+def test_retry_forgets_failures(settings):
+    col = models.Collection.objects.create(slug='col', path='/tmp')
+    doc = models.Document.objects.create(collection=col, path='x.zip',
+                                         sha1=SHA1, disk_size=1)
+    failures.record('7z', SHA1, ExtractingFailed())
+    call_command('extractionfailures', retry=True)
+    assert not models.ExtractionFailure.objects.exists()
+    [job] = models.Job.objects.filter(queue='digest')
+    assert job.data == {'id': doc.id}
+
+class FakeTika:
+
+    def __init__(self):
+        self.calls = []
+        self.status_code = 200
+        self.error = None
+        self.text = ''
+        self.headers = {}
+
+    def put(self, url, data, **kwargs):
+        self.calls.append(kwargs)
+        if self.error:
+            raise self.error
+        return self
+
+@pytest.fixture
+def tika(settings, monkeypatch):
+    settings.SNOOP_TIKA_SERVER_ENDPOINT = 'http://tika:9998'
+    settings.SNOOP_BACKEND_VERSIONS = {'tika': '1.14'}
+    settings.SNOOP_TIKA_TIMEOUT = 7
+    server = FakeTika()
+    monkeypatch.setattr(tikalib.requests, 'put', server.put)
+    return server
+
+def _parse():
+    return tikalib.tika_parse(SHA1, lambda: BytesIO(b'data'))
+
+def test_tika_errors_are_remembered(tika):
+    tika.status_code = 422
+    with pytest.raises(tikalib.TikaParseError):
+        _parse()
+    with pytest.raises(failures.KnownFailure) as e:
+        _parse()
+    assert e.value.flag == 'tika_error'
+    assert len(tika.calls) == 1
+
+def test_tika_server_errors_are_not_remembered(tika):
+    tika.status_code = 503
+    with pytest.raises(RuntimeError):
+        _parse()
+    assert not models.ExtractionFailure.objects.exists()
+
+def test_tika_timeouts_are_remembered(tika):
+    tika.error = ReadTimeout()
+    with pytest.raises(ReadTimeout):
+        _parse()
+    assert tika.calls[0]['timeout'] == 7
+    assert models.ExtractionFailure.objects.get().error == 'ReadTimeout'
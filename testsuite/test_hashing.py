@@ -0,0 +1,44 @@
+import hashlib
+import os
+from io import BytesIO
+from tempfile import NamedTemporaryFile, TemporaryFile
+import pytest
+from snoop import hashing
+from snoop.content_types import MAGIC_READ_LIMIT
+
+def _expected(data):
+    return (
+        hashlib.md5(data).hexdigest(),
+        hashlib.sha1(data).hexdigest(),
+        len(data),
+        data[:MAGIC_READ_LIMIT],
+    )
+
+@pytest.mark.parametrize('size', [0, 10, hashing.BLOCK_SIZE * 2 + 10])
+def test_hash_file_on_disk(size):
+    data = os.urandom(size)
+    with NamedTemporaryFile() as tmp:
+        tmp.write(data)
+        tmp.flush()
+        for parallel in [True, False]:
+            with open(tmp.name, 'rb') as f:
+                md5, sha1, fsize, head = hashing.hash_file(
+                    f, parallel=parallel, want_head=True)
+            assert (md5, sha1, fsize, bytes(head)) == _expected(data)
+
+def test_hash_stream_with_spool():
+    data = os.urandom(hashing.PARALLEL_MIN_SIZE + 10)
+    with TemporaryFile() as spool:
+        md5, sha1, fsize, head = hashing.hash_file(
+            BytesIO(data), spool, want_head=True)
+        spool.seek(0)
+        assert spool.read() == data
+    assert (md5, sha1, fsize, bytes(head)) == _expected(data)
+
+def test_head_only_when_wanted():
+    with NamedTemporaryFile() as tmp:
+        tmp.write(b'data')
+        tmp.flush()
+        with open(tmp.name, 'rb') as f:
+            assert hashing.hash_file(f)[3] is None
+    assert hashing.hash_file(BytesIO(b'data'))[3] is None
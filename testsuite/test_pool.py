@@ -0,0 +1,71 @@
+import os
+import signal
+import threading
+from time import sleep, time
+import pytest
+from django.conf import settings
+from django.core.management import call_command
+from snoop import models, queues, pool
+
+pytestmark = [
+    pytest.mark.django_db(transaction=True),
+    pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set"),
+]
+
+def test_prefork_recycles_workers_until_queue_is_empty():
+    queues.put_many('hotfix', ({'id': n} for n in range(7)))
+    call_command('worker', 'hotfix', processes=2, max_jobs=2, verbosity=0)
+    assert not models.Job.objects.filter(queue='hotfix').exists()
+
+def test_prefork_restarts_crashed_workers(tmpdir):
+    marker = tmpdir.join('crashed')
+
+    def target():
+        if not marker.check():
+            marker.write('')
+            os._exit(1)
+
+    pool.prefork(target, 1, restart_delay=0)
+    assert marker.check()
+
+def test_threaded_workers_share_the_queue():
+    queues.put_many('hotfix', ({'id': n} for n in range(20)))
+    call_command('worker', 'hotfix', threads=4, batch=2, verbosity=0)
+    assert not models.Job.objects.filter(queue='hotfix').exists()
+
+def test_threaded_raises_errors_after_all_threads_finish():
+    done = []
+
+    def target():
+        done.append(1)
+        if len(done) == 1:
+            raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        pool.threaded(target, 3)
+    assert len(done) == 3
+
+def _stop_soon(delay=0.3):
+    timer = threading.Timer(delay, os.kill, [os.getpid(), signal.SIGTERM])
+    timer.start()
+
+def test_prefork_children_finish_their_job_when_stopped(tmpdir):
+    marker = tmpdir.join('finished')
+
+    def target():
+        while not pool.stopping.wait(0.05):
+            pass
+        marker.write('')
+
+    _stop_soon()
+    pool.prefork(target, 2, stop_timeout=10)
+    assert marker.check()
+
+def test_prefork_kills_children_that_dont_stop():
+    def target():
+        sleep(60)
+
+    t0 = time()
+    _stop_soon()
+    pool.prefork(target, 1, stop_timeout=0.5)
+    assert time() - t0 < 5
@@ -0,0 +1,211 @@
+import threading
+from datetime import timedelta
+from time import time
+import pytest
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+from snoop import models, queues
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set"),
+]
+
+def _put_jobs(n):
+    for i in range(n):
+        queues.put('test', {'n': i})
+
+def test_claim_skips_started_jobs():
+    _put_jobs(5)
+    first = queues.claim('test', 3, in_order=True)
+    second = queues.claim('test', 3, in_order=True)
+    assert [job.data['n'] for job in first] == [0, 1, 2]
+    assert [job.data['n'] for job in second] == [3, 4]
+    assert queues.claim('test', 3) == []
+
+def test_iterate_in_batches():
+    _put_jobs(7)
+    seen = []
+    for work in queues.iterate('test', batch=3, in_order=True):
+        with work() as data:
+            seen.append(data['n'])
+    assert seen == list(range(7))
+    assert not models.Job.objects.filter(queue='test').exists()
+
+def test_iterate_releases_unprocessed_jobs():
+    _put_jobs(5)
+    iterator = queues.iterate('test', batch=5, in_order=True)
+    with next(iterator)() as data:
+        assert data['n'] == 0
+    iterator.close()
+    remaining = models.Job.objects.filter(queue='test')
+    assert remaining.count() == 4
+    assert not remaining.filter(started=True).exists()
+
+def test_expired_leases_are_reclaimed():
+    _put_jobs(2)
+    [crashed] = queues.claim('test', 1, in_order=True, worker='crashed')
+    models.Job.objects.filter(id=crashed.id).update(
+        lease_expires=timezone.now() - timedelta(seconds=1),
+    )
+    jobs = queues.claim('test', 5, in_order=True, worker='alive')
+    assert [job.id for job in jobs] == [crashed.id, crashed.id + 1]
+    assert not models.Job.objects.filter(worker='crashed').exists()
+
+def test_renew_extends_own_leases_only():
+    _put_jobs(2)
+    queues.claim('test', 1, worker='one')
+    queues.claim('test', 1, worker='two')
+    models.Job.objects.update(lease_expires=timezone.now())
+    assert queues.renew('one') == 1
+    assert models.Job.objects.get(worker='one').lease_expires > timezone.now()
+    assert models.Job.objects.get(worker='two').lease_expires < timezone.now()
+
+def test_higher_priority_jobs_are_claimed_first():
+    queues.put('test', {'n': 0}, priority=0)
+    queues.put('test', {'n': 1}, priority=2)
+    queues.put('test', {'n': 2}, priority=1)
+    claimed = [job.data['n'] for job in queues.claim('test', 3)]
+    assert claimed == [1, 2, 0]
+
+def test_round_robin_across_collections(document_collection):
+    small = document_collection
+    small.save()
+    big = models.Collection.objects.create(slug='big', path='/tmp')
+    for n in range(6):
+        queues.put('test', {'big': n}, collection_id=big.id)
+    queues.put('test', {'small': 0}, collection_id=small.id)
+    queues.put('test', {'small': 1}, collection_id=small.id)
+
+    schedule = queues.RoundRobin('test')
+    claimed = [schedule.claim(batch=2) for _ in range(5)]
+    owners = [{'big' if 'big' in job.data else 'small' for job in jobs}
+              for jobs in claimed[:4]]
+    assert sorted(owners[:2], key=sorted) == [{'big'}, {'small'}]
+    assert owners[2:] == [{'big'}, {'big'}]
+    assert claimed[4] == []
+
+def test_round_robin_includes_expired_leases(document_collection):
+    document_collection.save()
+    other = models.Collection.objects.create(slug='other', path='/tmp')
+    queues.put('test', {'n': 0}, collection_id=document_collection.id)
+    queues.put('test', {'n': 1}, collection_id=other.id, priority=1)
+    queues.claim('test', 1, worker='crashed', collection_id=other.id)
+    models.Job.objects.filter(worker='crashed').update(
+        lease_expires=timezone.now() - timedelta(seconds=1),
+    )
+
+    schedule = queues.RoundRobin('test')
+    schedule.reload()
+    assert schedule.collections == [other.id, document_collection.id]
+
+@pytest.mark.django_db(transaction=True)
+def test_wait_wakes_up_on_new_jobs():
+    queues.listen()
+    assert not queues.wait('test', 0.1)
+    queues.put('other', {'n': 0})
+    assert not queues.wait('test', 0.1)
+    queues.put('test', {'n': 0})
+    assert queues.wait('test', 5)
+
+def test_put_many_skips_existing_jobs(monkeypatch):
+    monkeypatch.setattr(queues, 'PUT_CHUNK_SIZE', 4)
+    queues.put('test', {'n': 3})
+    added = queues.put_many('test', ({'n': n} for n in range(10)), priority=1)
+    assert added == 9
+    jobs = models.Job.objects.filter(queue='test')
+    assert sorted(job.data['n'] for job in jobs) == list(range(10))
+    assert jobs.filter(priority=1).count() == 9
+
+def test_put_query_queues_rows_in_the_database():
+    queues.put('test', {'n': 1})
+    select = "SELECT jsonb_build_object('n', n), 3, NULL FROM generate_series(0, %s) n"
+    assert queues.put_query('test', select, [4]) == 4
+    jobs = models.Job.objects.filter(queue='test', priority=3)
+    assert sorted(job.data['n'] for job in jobs) == [0, 2, 3, 4]
+
+def test_digestqueue_in_db(document_collection):
+    document_collection.save()
+    folder = models.Document.objects.create(
+        collection=document_collection, path='a', filename='a',
+        content_type=models.FOLDER, disk_size=0,
+    )
+    models.Document.objects.create(
+        collection=document_collection, path='a/b', filename='b',
+        parent=folder, disk_size=2**30,
+    )
+    call_command('digestqueue', '--in-db', '--where', "path like 'a%'")
+    jobs = models.Job.objects.filter(queue='digest').order_by('data')
+    assert [(job.data['id'], job.priority) for job in jobs] == \
+        [(folder.id, 2), (folder.id + 1, 0)]
+    assert {job.collection_id for job in jobs} == {document_collection.id}
+
+def test_failed_jobs_are_retried_then_given_up(settings):
+    settings.SNOOP_QUEUE_RETRY = {'default': {'attempts': 2, 'backoff': 60}}
+    queues.put('test', {'n': 0})
+
+    def run_once():
+        for work in queues.iterate('test'):
+            with work():
+                raise RuntimeError("boom")
+
+    run_once()
+    job = models.Job.objects.get(queue='test')
+    assert (job.started, job.attempts) == (False, 1)
+    assert job.not_before > timezone.now()
+    run_once()
+    assert models.Job.objects.filter(queue='test').exists()
+
+    models.Job.objects.update(not_before=timezone.now() - timedelta(hours=1))
+    run_once()
+    assert not models.Job.objects.filter(queue='test').exists()
+    [failed] = models.FailedJob.objects.filter(queue='test')
+    assert failed.data == {'n': 0}
+    assert failed.attempts == 2
+    assert failed.error == 'RuntimeError: boom'
+    assert 'Traceback' in failed.traceback
+
+def test_jobs_of_crashing_workers_are_given_up(settings):
+    settings.SNOOP_QUEUE_RETRY = {'default': {'attempts': 1, 'backoff': 60}}
+    queues.put('test', {'n': 0})
+    queues.claim('test', worker='crashed')
+    models.Job.objects.update(lease_expires=timezone.now() - timedelta(hours=1))
+    assert list(queues.iterate('test')) == []
+    [failed] = models.FailedJob.objects.all()
+    assert failed.error == 'Lease expired'
+
+def test_retried_failed_jobs_keep_priority_and_collection(settings):
+    settings.SNOOP_QUEUE_RETRY = {'default': {'attempts': 1, 'backoff': 60}}
+    col = models.Collection.objects.create(slug='col', path='/tmp')
+    queues.put('test', {'n': 0}, priority=5, collection_id=col.id)
+    for work in queues.iterate('test'):
+        with work():
+            raise RuntimeError("boom")
+
+    call_command('failedjobs', 'test', retry=True)
+    job = models.Job.objects.get(queue='test')
+    assert (job.priority, job.collection_id) == (5, col.id)
+    assert not models.FailedJob.objects.exists()
+
+def test_stop_puts_the_rest_of_the_batch_back():
+    queues.put_many('hotfix', ({'id': n} for n in range(3)))
+    stop = threading.Event()
+    done = []
+    for work in queues.iterate('hotfix', batch=3, stop=stop):
+        with work() as data:
+            done.append(data['id'])
+        stop.set()
+
+    assert len(done) == 1
+    left = models.Job.objects.filter(queue='hotfix')
+    assert left.count() == 2
+    assert not left.filter(started=True).exists()
+
+def test_stop_wakes_up_waiting_workers(settings):
+    settings.SNOOP_QUEUE_POLL_INTERVAL = 60
+    stop = threading.Event()
+    threading.Timer(0.3, stop.set).start()
+    t0 = time()
+    assert list(queues.iterate('hotfix', wait_for_jobs=True, stop=stop)) == []
+    assert time() - t0 < 5
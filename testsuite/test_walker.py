@@ -0,0 +1,332 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import pytest
+from django.conf import settings
+from django.utils import timezone
+from snoop import models, queues, walker
+from snoop.models import FOLDER
+from snoop.watcher import Inotify, Watcher
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(not settings.DATABASES, reason="DATABASES not set"),
+]
+
+@pytest.fixture
+def tree():
+    with TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / 'one').mkdir()
+        (root / 'one' / 'two').mkdir()
+        (root / 'a.txt').write_bytes(b'a')
+        (root / 'one' / 'b.txt').write_bytes(b'bb')
+        (root / 'one' / 'two' / 'c.txt').write_bytes(b'ccc')
+        yield root
+
+def _walk(col, prefix=None):
+    walker.Walker.walk(
+        root=col.path,
+        prefix=prefix,
+        container_doc=None,
+        collection=col,
+    )
+
+def _queued():
+    return sorted(
+        models.Document.objects.get(id=job.data['id']).path
+        for job in models.Job.objects.filter(queue='digest')
+    )
+
+def test_walk_creates_documents(tree):
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+
+    docs = {doc.path: doc for doc in col.document_set.all()}
+    assert sorted(docs) == [
+        '', 'a.txt', 'one', 'one/b.txt', 'one/two', 'one/two/c.txt',
+    ]
+    assert docs['one'].content_type == FOLDER
+    assert docs['one/two/c.txt'].disk_size == 3
+    assert docs['one/two/c.txt'].parent == docs['one/two']
+    assert docs['a.txt'].parent == docs['']
+    assert _queued() == sorted(p for p in docs if p)
+
+def test_walk_again_queues_modified_files(tree):
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    models.Job.objects.all().delete()
+    col.document_set.update(digested_at=timezone.now())
+
+    future = timezone.now().timestamp() + 10
+    os.utime(str(tree / 'one' / 'b.txt'), (future, future))
+    (tree / 'one' / 'd.txt').write_bytes(b'd')
+    _walk(col)
+
+    assert col.document_set.count() == 7
+    assert _queued() == ['one/b.txt', 'one/d.txt']
+
+def test_walk_again_digests_new_content(tree, settings):
+    settings.SNOOP_CACHE = True
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    _digest_all()
+
+    (tree / 'one' / 'b.txt').write_bytes(b'cc')
+    future = timezone.now().timestamp() + 10
+    os.utime(str(tree / 'one' / 'b.txt'), (future, future))
+    _walk(col)
+    _digest_all()
+
+    doc = col.document_set.get(path='one/b.txt')
+    data = json.loads(models.Digest.objects.get(id=doc.id).data)
+    assert data['text'] == 'cc'
+    assert doc.sha1 == hashlib.sha1(b'cc').hexdigest()
+
+def test_walk_prefix(tree):
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col, 'one/two')
+
+    docs = {doc.path: doc for doc in col.document_set.all()}
+    assert sorted(docs) == ['', 'one', 'one/two', 'one/two/c.txt']
+    assert docs['one/two'].parent == docs['one']
+
+def test_walk_prefix_keeps_the_rest(tree):
+    (tree / 'one' / 'three').mkdir()
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    _walk(col, 'one/two')
+    _walk(col, 'one/two/c.txt')
+    assert not col.document_set.filter(deleted=True).exists()
+
+@pytest.mark.django_db(transaction=True)
+def test_walk_threaded(tree):
+    for n in range(20):
+        folder = tree / 'many' / str(n)
+        folder.mkdir(parents=True)
+        (folder / 'file.txt').write_bytes(b'x')
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    walker.Walker.walk(
+        root=col.path,
+        prefix=None,
+        container_doc=None,
+        collection=col,
+        jobs=4,
+    )
+
+    docs = {doc.path: doc for doc in col.document_set.all()}
+    assert col.document_set.count() == len(docs) == 6 + 1 + 20 * 2
+    assert docs['many/7/file.txt'].parent == docs['many/7']
+    assert docs['many/7'].parent == docs['many']
+    assert len(_queued()) == len(docs) - 1
+
+def test_rewalk_skips_unchanged_folders(tree, capsys):
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    assert models.FolderManifest.objects.count() == 3
+    models.Job.objects.all().delete()
+    col.document_set.update(digested_at=timezone.now())
+    capsys.readouterr()
+
+    _walk(col)
+    assert 'WALK FOLDER' not in capsys.readouterr().out
+    assert _queued() == []
+
+    (tree / 'one' / 'two' / 'd.txt').write_bytes(b'd')
+    future = timezone.now().timestamp() + 10
+    os.utime(str(tree / 'one' / 'two'), (future, future))
+    _walk(col)
+    walked = [line.split()[-1] for line in capsys.readouterr().out.splitlines()
+              if line.startswith('WALK FOLDER')]
+    # the parent sees the new mtime of `one/two`, the root sees nothing
+    assert walked == ['one', 'one/two']
+    assert _queued() == ['one/two', 'one/two/d.txt']
+
+def _digest_all():
+    from snoop import digest
+    for work in queues.iterate('digest'):
+        with work() as data:
+            digest.worker(verbose=False, **data)
+
+def test_deleted_files_are_tombstoned(tree, client):
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    _digest_all()
+
+    shutil.rmtree(str(tree / 'one'))
+    _walk(col)
+    deleted = col.document_set.filter(deleted=True)
+    assert sorted(doc.path for doc in deleted) == [
+        'one', 'one/b.txt', 'one/two', 'one/two/c.txt',
+    ]
+    root = col.document_set.get(path='')
+    assert [f['filename'] for f in walker.files_in(root)] == ['a.txt']
+
+    feed = client.get('/walk/feed').json()
+    tombstones = [d for d in feed['documents'] if d.get('deleted')]
+    assert len(tombstones) == 4
+
+    (tree / 'one').mkdir()
+    (tree / 'one' / 'b.txt').write_bytes(b'bb')
+    _walk(col)
+    assert sorted(doc.path for doc in deleted.all()) == [
+        'one/two', 'one/two/c.txt',
+    ]
+
+def test_moved_file_reuses_digest(tree, monkeypatch, settings):
+    settings.SNOOP_CACHE = True
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    _digest_all()
+
+    (tree / 'one' / 'b.txt').rename(tree / 'moved.txt')
+    _walk(col)
+    def no_guessing(doc):
+        raise AssertionError("should reuse the digest")
+    monkeypatch.setattr('snoop.digest.guess_filetype', no_guessing)
+    _digest_all()
+
+    moved = col.document_set.get(path='moved.txt')
+    data = json.loads(models.Digest.objects.get(id=moved.id).data)
+    assert data['path'] == 'moved.txt'
+    assert data['filename'] == 'moved.txt'
+    assert data['text'] == 'bb'
+
+def _move_b(tree, col, monkeypatch):
+    """ Move one/b.txt once its content was digested, with no stored
+    content to reuse, so only the digest of the deleted file can be. """
+    models.ContentDigest.objects.all().delete()
+    (tree / 'one' / 'b.txt').rename(tree / 'moved.txt')
+    _walk(col)
+    from snoop.digest import guess_filetype
+    guessed = []
+    def guessing(doc):
+        guessed.append(doc.path)
+        return guess_filetype(doc)
+    monkeypatch.setattr('snoop.digest.guess_filetype', guessing)
+    _digest_all()
+    return col.document_set.get(path='moved.txt'), guessed
+
+def test_moved_file_reuses_digest_without_stored_content(tree, monkeypatch,
+                                                         settings):
+    settings.SNOOP_CACHE = True
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    _digest_all()
+    old = col.document_set.get(path='one/b.txt')
+    digest = models.Digest.objects.get(id=old.id)
+    digest.data = json.dumps(dict(json.loads(digest.data), pgp=True))
+    digest.save()
+
+    moved, guessed = _move_b(tree, col, monkeypatch)
+    assert 'moved.txt' not in guessed
+    assert moved.flags == {'pgp': True}
+    data = json.loads(models.Digest.objects.get(id=moved.id).data)
+    assert data['path'] == 'moved.txt'
+    assert data['text'] == 'bb'
+    assert data['pgp'] is True
+
+def test_moved_file_ignores_digest_of_other_version(tree, monkeypatch,
+                                                    settings):
+    settings.SNOOP_CACHE = True
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    _digest_all()
+    monkeypatch.setattr('snoop.digest.CONTENT_VERSION', -1)
+
+    moved, guessed = _move_b(tree, col, monkeypatch)
+    assert 'moved.txt' in guessed
+    data = json.loads(models.Digest.objects.get(id=moved.id).data)
+    assert data['text'] == 'bb'
+
+def test_resume_interrupted_walk(tree, monkeypatch, capsys):
+    (tree / 'zz').mkdir()
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+
+    handle_folder = walker.Walker.handle_folder
+    def crash_in_two(self, folder, doc):
+        if folder.name == 'two':
+            raise KeyboardInterrupt
+        return handle_folder(self, folder, doc)
+    monkeypatch.setattr(walker.Walker, 'handle_folder', crash_in_two)
+    _walk(col)
+    assert models.WalkCursor.objects.get(collection=col).path == 'one'
+
+    monkeypatch.setattr(walker.Walker, 'handle_folder', handle_folder)
+    models.FolderManifest.objects.all().delete()
+    # created after the root was synced, but after the cursor too
+    (tree / 'zzz').mkdir()
+    (tree / 'zzz' / 'new.txt').write_bytes(b'new')
+    capsys.readouterr()
+    walker.Walker.walk(
+        root=col.path,
+        prefix=None,
+        container_doc=None,
+        collection=col,
+        resume=True,
+    )
+    walked = [line.split()[-1] for line in capsys.readouterr().out.splitlines()
+              if line.startswith('WALK FOLDER')]
+    assert walked == ['.', 'one/two', 'zz', 'zzz']
+    assert col.document_set.filter(path='one/two/c.txt').exists()
+    assert col.document_set.filter(path='zzz/new.txt').exists()
+    assert not models.WalkCursor.objects.exists()
+
+@pytest.mark.django_db(transaction=True)
+def test_threaded_walk_clears_cursor(tree):
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    models.WalkCursor.objects.create(collection=col, prefix='', path='one')
+    walker.Walker.walk(
+        root=col.path,
+        prefix=None,
+        container_doc=None,
+        collection=col,
+        jobs=4,
+    )
+    assert col.document_set.filter(path='one/two/c.txt').exists()
+    assert not models.WalkCursor.objects.exists()
+
+def test_prefix_walk_loads_only_its_manifests(tree):
+    (tree / 'one2').mkdir()
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    _walk(col)
+    assert models.FolderManifest.objects.count() == 4
+
+    prefix_walker = walker.Walker(col.path, 'one', None, col)
+    prefix_walker.load_manifests()
+    assert set(prefix_walker.folders) == {'one', 'one/two'}
+    assert len(prefix_walker.manifests) == 2
+
+def test_watch_syncs_changed_folders(tree, settings):
+    settings.SNOOP_WATCH_BATCH_DELAY = 0.2
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    watcher = Watcher(col)
+    assert watcher.start()
+    _walk(col)
+    models.Job.objects.all().delete()
+
+    (tree / 'one' / 'two' / 'new.txt').write_bytes(b'new')
+    (tree / 'three' / 'four').mkdir(parents=True)
+    (tree / 'three' / 'four' / 'deep.txt').write_bytes(b'deep')
+    (tree / 'a.txt').unlink()
+    watcher.poll(timeout=5)
+
+    docs = {doc.path: doc for doc in col.document_set.all()}
+    assert docs['a.txt'].deleted
+    assert docs['three/four/deep.txt'].parent == docs['three/four']
+    assert {'one/two/new.txt', 'three/four/deep.txt'} <= set(_queued())
+    assert any(path == tree / 'three' / 'four'
+               for path in watcher.watches.values())
+
+def test_watch_falls_back_to_rescans(tree, monkeypatch):
+    def no_more_watches(self, path, mask=None):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(Inotify, 'add_watch', no_more_watches)
+    col = models.Collection.objects.create(slug='walk', path=str(tree))
+    watcher = Watcher(col)
+    assert not watcher.start()
+    assert watcher.inotify is None